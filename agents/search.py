@@ -1,6 +1,16 @@
-from utils import get_langgraph_docs_retriever, llm
+from startup import ImportTimer
+_import_timer = ImportTimer(__name__)
+
+import os
+import threading
+import time
+
+from embeddings import get_model_name
+from tokens import estimate_tokens
+from utils import STREAM_GENERATION, get_embedding_model, get_langgraph_docs_retriever, llm, stream_answer
+from startup import lazy_resource
 from langchain.schema import Document
-from typing import List
+from typing import List, Optional, Tuple
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.types import interrupt
@@ -8,9 +18,39 @@ from pydantic import BaseModel, Field
 from typing_extensions import Annotated
 import operator
 from langchain_core.messages import AnyMessage, get_buffer_string, SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+# NOTE: Configure how retrieved documents are graded for relevance
+# - "sequential": one grader call per document, one after another
+# - "concurrent": one grader call per document, up to GRADING_MAX_CONCURRENCY at a time
+# - "batch": a single structured-output call that grades every document at once
+GRADING_MODE = os.getenv("GRADING_MODE", "concurrent")
+GRADING_MAX_CONCURRENCY = int(os.getenv("GRADING_MAX_CONCURRENCY", "8"))
+
+# NOTE: Configure the similarity pre-filter in front of the relevance grader: (reject below, accept at or above)
+# for the retriever's similarity scores, keyed by embedding model, since every model spreads cosine similarity
+# differently. Only documents scoring in between are sent to the LLM. No model ships with thresholds, so every
+# document is graded until you measure where that model's relevant and irrelevant chunks fall and add an entry
+# here, or set PREFILTER_REJECT_BELOW and PREFILTER_ACCEPT_AT for the configured embedding model. Documents the
+# retriever didn't score (BM25-only hits in hybrid mode) always go to the LLM. Set PREFILTER_ENABLED=false to
+# grade everything.
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "true").lower() == "true"
+PREFILTER_THRESHOLDS = {}
+PREFILTER_REJECT_BELOW = os.getenv("PREFILTER_REJECT_BELOW")
+PREFILTER_ACCEPT_AT = os.getenv("PREFILTER_ACCEPT_AT")
+
+# NOTE: Configure how much conversation history goes into prompts. The most recent messages that fit in
+# CONTEXT_TOKEN_BUDGET are included verbatim; older ones are folded into a rolling summary.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
 
+# NOTE: Configure speculative generation. When enabled, grade_documents starts generating an answer from the
+# documents the pre-filter kept while the LLM grades the rest, and keeps that answer if grading rejects nothing.
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "false").lower() == "true"
 
-retriever = get_langgraph_docs_retriever()
+
+def get_retriever():
+    return get_langgraph_docs_retriever(k=4, fetch_k=20, lambda_mult=0.5)
 
 class GraphState(TypedDict):
     question: str
@@ -18,6 +58,12 @@ class GraphState(TypedDict):
     generation: str
     documents: List[Document]
     attempted_generations: int
+    grading_timings: List[dict]     # Per-document grading verdicts and latencies from the last grade_documents
+    speculative_generation_kept: bool   # grade_documents already produced the generation for these documents
+    grounding_checked: Optional[bool]   # Result of the grounding checks while streaming; None if not streamed
+    conversation: str               # Summary plus recent messages, rendered once per turn for every prompt
+    summary: str                    # Rolling summary of the messages that fell out of the window
+    summarized_count: int           # How many leading messages the summary covers
 
 class InputState(TypedDict):
     question: str
@@ -37,7 +83,7 @@ def retrieve_documents(state: GraphState):
     """
     print("---RETRIEVE DOCUMENTS---")
     question = state["question"]
-    documents = retriever.invoke(question)
+    documents = get_retriever().invoke(question)
     return {"documents": documents}
 
 RAG_PROMPT_WITH_CHAT_HISTORY = """You are an assistant for question-answering tasks. 
@@ -57,6 +103,20 @@ Additional Context from Documents:
 
 Answer:"""
 
+def generate(question: str, documents: List[Document], conversation: str):
+    formatted_docs = "\n\n".join(doc.page_content for doc in documents)
+    rag_prompt_formatted = RAG_PROMPT_WITH_CHAT_HISTORY.format(context=formatted_docs, conversation=conversation, question=question)
+    return llm.invoke([HumanMessage(content=rag_prompt_formatted)])
+
+def stream_generate(question: str, documents: List[Document], conversation: str):
+    """Stream the answer, checking what has been generated so far against the documents as sentences complete."""
+    formatted_docs = "\n\n".join(doc.page_content for doc in documents)
+    rag_prompt_formatted = RAG_PROMPT_WITH_CHAT_HISTORY.format(context=formatted_docs, conversation=conversation, question=question)
+    return stream_answer(
+        [HumanMessage(content=rag_prompt_formatted)],
+        check_prefix=lambda answer: is_grounded(formatted_docs, answer),
+    )
+
 def generate_response(state: GraphState):
     # We interrupt the graph, and ask the user for some additional context
     # additional_context = interrupt("Do you have anything else to add that you think is relevant?")
@@ -64,15 +124,17 @@ def generate_response(state: GraphState):
     question = state["question"]
     documents = state["documents"]
     # For simplicity, we'll just append the additional context to the conversation history
-    conversation = get_buffer_string(state["messages"]) # + additional_context
+    conversation = state.get("conversation", "") # + additional_context
     attempted_generations = state.get("attempted_generations", 0)
-    formatted_docs = "\n\n".join(doc.page_content for doc in documents)
-    
-    rag_prompt_formatted = RAG_PROMPT_WITH_CHAT_HISTORY.format(context=formatted_docs, conversation=conversation, question=question)
-    generation = llm.invoke([HumanMessage(content=rag_prompt_formatted)])
+    grounding_checked = None
+    if STREAM_GENERATION:
+        generation, grounding_checked = stream_generate(question, documents, conversation)
+    else:
+        generation = generate(question, documents, conversation)
     return {
         "generation": generation,
-        "attempted_generations": attempted_generations + 1
+        "attempted_generations": attempted_generations + 1,
+        "grounding_checked": grounding_checked,
     }
 
 class GradeDocuments(BaseModel):
@@ -80,32 +142,172 @@ class GradeDocuments(BaseModel):
         description="The document is relevant to the question, true or false"
     )
 
-grade_documents_llm = llm.with_structured_output(GradeDocuments)
+@lazy_resource
+def get_grade_documents_llm():
+    return llm.with_structured_output(GradeDocuments)
+
 grade_documents_system_prompt = """You are a grader assessing relevance of a retrieved document to a conversation between a user and an AI assistant, and user's latest question. \n 
     If the document contains keyword(s) or semantic meaning related to the user question, definitely grade it as relevant. \n
     It does not need to be a stringent test. The goal is to filter out erroneous retrievals that are not relevant at all. \n
     Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question."""
 grade_documents_prompt = "Here is the retrieved document: \n\n {document} \n\n Here is the conversation so far: \n\n {conversation} \n\n Here is the user question: \n\n {question}"
+
+class GradeDocumentsBatch(BaseModel):
+    """Relevance verdicts for a numbered list of documents."""
+    verdicts: List[bool] = Field(
+        description="One verdict per document, in the order the documents are given: true if relevant, false if not"
+    )
+
+@lazy_resource
+def get_grade_documents_batch_llm():
+    return llm.with_structured_output(GradeDocumentsBatch)
+
+grade_documents_batch_prompt = "Here are the {count} retrieved documents: \n\n {documents} \n\n Here is the conversation so far: \n\n {conversation} \n\n Here is the user question: \n\n {question} \n\n Return exactly {count} verdicts, one per document, in order."
+
+def grade_document(messages, config: RunnableConfig) -> Tuple[bool, float]:
+    started = time.perf_counter()
+    score = get_grade_documents_llm().invoke(messages, config)
+    return score.is_relevant, time.perf_counter() - started
+
+def grade_relevance(documents: List[Document], question: str, conversation: str) -> List[Tuple[bool, float]]:
+    """(is_relevant, seconds) per document, in document order, graded as GRADING_MODE says."""
+    if GRADING_MODE == "batch" and documents:
+        formatted_docs = "\n\n".join(f"Document {i + 1}:\n{d.page_content}" for i, d in enumerate(documents))
+        started = time.perf_counter()
+        result = get_grade_documents_batch_llm().invoke(
+            [SystemMessage(content=grade_documents_system_prompt)] + [HumanMessage(content=grade_documents_batch_prompt.format(
+                count=len(documents), documents=formatted_docs, question=question, conversation=conversation
+            ))]
+        )
+        elapsed = time.perf_counter() - started
+        if len(result.verdicts) == len(documents):
+            # One call graded them all, so each document's latency is that call's
+            return [(verdict, elapsed) for verdict in result.verdicts]
+        print(f"---GRADE: BATCH RETURNED {len(result.verdicts)} VERDICTS FOR {len(documents)} DOCUMENTS, GRADING ONE BY ONE---")
+
+    inputs = [
+        [SystemMessage(content=grade_documents_system_prompt)] + [HumanMessage(content=grade_documents_prompt.format(
+            document=d.page_content, question=question, conversation=conversation
+        ))]
+        for d in documents
+    ]
+    max_concurrency = 1 if GRADING_MODE == "sequential" else GRADING_MAX_CONCURRENCY
+    # batch() keeps input order; each call runs on its own worker thread
+    return RunnableLambda(grade_document).batch(inputs, config={"max_concurrency": max_concurrency})
+
+def prefilter_score(document: Document) -> Optional[float]:
+    """The retriever's similarity for the document, or None when it has none."""
+    similarity = document.metadata.get("similarity")
+    return float(similarity) if similarity is not None else None
+
+def prefilter_thresholds() -> Optional[Tuple[float, float]]:
+    """(reject below, accept at) for the configured embedding model, or None to leave every document to the LLM."""
+    if PREFILTER_REJECT_BELOW and PREFILTER_ACCEPT_AT:
+        return float(PREFILTER_REJECT_BELOW), float(PREFILTER_ACCEPT_AT)
+    return PREFILTER_THRESHOLDS.get(get_model_name(get_embedding_model()))
+
+class PrefilterStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.graded = 0
+        self.llm_calls = 0
+        self.llm_calls_saved = 0
+
+    def record(self, accepted: int, rejected: int, graded: int):
+        # Per-document grading makes one call per graded document, batch grading one call if any
+        calls = min(graded, 1) if GRADING_MODE == "batch" else graded
+        calls_without_prefilter = min(accepted + rejected + graded, 1) if GRADING_MODE == "batch" else accepted + rejected + graded
+        with self.lock:
+            self.accepted += accepted
+            self.rejected += rejected
+            self.graded += graded
+            self.llm_calls += calls
+            self.llm_calls_saved += calls_without_prefilter - calls
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "auto_accepted": self.accepted,
+                "auto_rejected": self.rejected,
+                "llm_graded": self.graded,
+                "llm_calls": self.llm_calls,
+                "llm_calls_saved": self.llm_calls_saved,
+            }
+
+prefilter_stats = PrefilterStats()
+
+def get_prefilter_stats() -> dict:
+    return prefilter_stats.as_dict()
+
+_speculation_executor = ContextThreadPoolExecutor(max_workers=GRADING_MAX_CONCURRENCY)
+
 def grade_documents(state):
     print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
     question = state["question"]
     documents = state["documents"]
-    conversation = get_buffer_string(state["messages"])
+    conversation = state.get("conversation", "")
 
-    filtered_docs = []
+    started = time.perf_counter()
+    # Tier 1: settle clearly relevant / clearly irrelevant documents from their similarity alone
+    decisions = []  # (tier, score, is_relevant or None when the LLM has to decide)
+    thresholds = prefilter_thresholds() if PREFILTER_ENABLED else None
     for d in documents:
-        grade_documents_prompt_formatted = grade_documents_prompt.format(document=d.page_content, question=question, conversation=conversation)
-        score = grade_documents_llm.invoke(
-            [SystemMessage(content=grade_documents_system_prompt)] + [HumanMessage(content=grade_documents_prompt_formatted)]
-        )
-        grade = score.is_relevant
+        score = prefilter_score(d)
+        if thresholds is None or score is None:
+            decisions.append(("llm", score, None))
+        elif score >= thresholds[1]:
+            decisions.append(("accepted", score, True))
+        elif score < thresholds[0]:
+            decisions.append(("rejected", score, False))
+        else:
+            decisions.append(("llm", score, None))
+
+    # Tier 2: the LLM grades the ambiguous middle band
+    ambiguous = [d for d, (_, _, grade) in zip(documents, decisions) if grade is None]
+    speculation = None
+    if SPECULATIVE_GENERATION and ambiguous:
+        # Generate from everything tier 1 kept while the grader works; usually the grader keeps it all too
+        candidates = [d for d, (_, _, grade) in zip(documents, decisions) if grade is not False]
+        print("---SPECULATIVE GENERATE RESPONSE---")
+        speculation = _speculation_executor.submit(generate, question, candidates, conversation)
+    llm_grades = iter(grade_relevance(ambiguous, question, conversation) if ambiguous else [])
+    elapsed = time.perf_counter() - started
+
+    filtered_docs = []
+    timings = []
+    for d, (tier, score, grade) in zip(documents, decisions):
+        seconds = 0.0
+        if grade is None:
+            grade, seconds = next(llm_grades)
+        timings.append({"source": d.metadata.get("source"), "tier": tier, "score": score, "is_relevant": grade, "seconds": seconds})
         if grade:
-            print("---GRADE: DOCUMENT RELEVANT---")
+            print(f"---GRADE: DOCUMENT RELEVANT ({tier})---")
             filtered_docs.append(d)
         else:
-            print("---GRADE: DOCUMENT NOT RELEVANT---")
-            continue
-    return {"documents": filtered_docs}
+            print(f"---GRADE: DOCUMENT NOT RELEVANT ({tier})---")
+
+    accepted = sum(tier == "accepted" for tier, _, _ in decisions)
+    rejected = sum(tier == "rejected" for tier, _, _ in decisions)
+    prefilter_stats.record(accepted, rejected, len(ambiguous))
+    print(f"---GRADED {len(documents)} DOCUMENTS IN {elapsed:.2f}s ({accepted} auto-accepted, {rejected} auto-rejected, {len(ambiguous)} by LLM, {GRADING_MODE})---")
+    update = {"documents": filtered_docs, "grading_timings": timings, "speculative_generation_kept": False}
+
+    if speculation is not None:
+        if len(filtered_docs) == len(documents) - rejected:
+            # The grader rejected nothing, so the speculative answer used exactly the filtered documents
+            print("---SPECULATIVE GENERATION KEPT---")
+            update.update({
+                "generation": speculation.result(),
+                "attempted_generations": state.get("attempted_generations", 0) + 1,
+                "speculative_generation_kept": True,
+                "grounding_checked": None,
+            })
+        else:
+            print("---SPECULATIVE GENERATION DISCARDED---")
+            speculation.cancel()  # Only helps if it hasn't started; otherwise its result is ignored
+    return update
 
 def decide_to_generate(state):
     """
@@ -122,6 +324,10 @@ def decide_to_generate(state):
             "---DECISION: ALL DOCUMENTS ARE NOT RELEVANT TO QUESTION, END---"
         )
         return "none relevant"
+    elif state.get("speculative_generation_kept"):
+        # The answer already exists, so go straight to checking it
+        print("---DECISION: USE SPECULATIVE GENERATION---")
+        return grade_hallucinations(state)
     else:
         # We have relevant documents, so generate answer
         print("---DECISION: GENERATE---")
@@ -133,30 +339,40 @@ class GradeHallucinations(BaseModel):
         description="Answer is grounded in the facts, true or false"
     )
 
-grade_hallucinations_llm = llm.with_structured_output(GradeHallucinations)
+@lazy_resource
+def get_grade_hallucinations_llm():
+    return llm.with_structured_output(GradeHallucinations)
+
 grade_hallucinations_system_prompt = """You are a grader assessing whether an LLM generation is grounded in / supported by a set of retrieved facts. \n 
      Give a binary score true or false. True means that the answer is grounded in / supported by the set of facts."""
 grade_hallucinations_prompt = "Set of facts: \n\n {documents} \n\n LLM generation: {generation}"
 
 ATTEMPTED_GENERATION_MAX = 3
 
-def grade_hallucinations(state):
-    print("---CHECK HALLUCINATIONS---")
-    documents = state["documents"]
-    generation = state["generation"]
-    attempted_generations = state["attempted_generations"]
-
-    formatted_docs = "\n\n".join(doc.page_content for doc in documents)
-
+def is_grounded(formatted_docs: str, generation) -> bool:
     grade_hallucinations_prompt_formatted = grade_hallucinations_prompt.format(
         documents=formatted_docs,
         generation=generation
     )
 
-    score = grade_hallucinations_llm.invoke(
+    score = get_grade_hallucinations_llm().invoke(
         [SystemMessage(content=grade_hallucinations_system_prompt)] + [HumanMessage(content=grade_hallucinations_prompt_formatted)]
     )
-    grade = score.grounded_in_facts
+    return score.grounded_in_facts
+
+def grade_hallucinations(state):
+    print("---CHECK HALLUCINATIONS---")
+    documents = state["documents"]
+    generation = state["generation"]
+    attempted_generations = state["attempted_generations"]
+
+    grade = state.get("grounding_checked")
+    if grade is None:
+        formatted_docs = "\n\n".join(doc.page_content for doc in documents)
+        grade = is_grounded(formatted_docs, generation)
+    else:
+        # Every sentence was already checked while the answer streamed (or it stopped at the first that failed)
+        print("---USING SENTENCE-LEVEL GROUNDING CHECKS FROM STREAMING---")
 
     # Check hallucination
     if grade:
@@ -170,13 +386,57 @@ def grade_hallucinations(state):
         print("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY---")
         return "not supported"
     
+summarize_conversation_prompt = """Here is a summary of a conversation so far:
+
+{summary}
+
+Here are the next messages in the conversation:
+
+{new_lines}
+
+Rewrite the summary so it also covers the new messages. Keep the facts, questions and answers that later questions may refer to, and keep it under 150 words. Return only the summary."""
+
+def build_context(messages: List[AnyMessage], summary: str, summarized_count: int) -> dict:
+    """
+    Keep the most recent messages that fit in CONTEXT_TOKEN_BUDGET, fold any older ones not yet in the
+    summary into it (one LLM call, only for the messages that just left the window), and render the
+    conversation string every node uses next turn.
+    """
+    start = len(messages)
+    tokens = estimate_tokens(summary) if summary else 0
+    while start > summarized_count:
+        message_tokens = estimate_tokens(get_buffer_string([messages[start - 1]]))
+        if tokens + message_tokens > CONTEXT_TOKEN_BUDGET and start < len(messages):
+            break
+        tokens += message_tokens
+        start -= 1
+    # Start the window on a question, even past the budget, so an answer is never shown without
+    # what it answered. Earlier windows started on one too, so this stops at summarized_count.
+    while start > summarized_count and start < len(messages) and not isinstance(messages[start], HumanMessage):
+        start -= 1
+
+    if start > summarized_count:
+        print(f"---SUMMARIZE {start - summarized_count} OLDER MESSAGES---")
+        summary = llm.invoke([HumanMessage(content=summarize_conversation_prompt.format(
+            summary=summary or "(empty)", new_lines=get_buffer_string(messages[summarized_count:start])
+        ))]).content
+        summarized_count = start
+
+    conversation = get_buffer_string(messages[start:])
+    if summary:
+        conversation = f"Summary of earlier conversation: {summary}\n\n{conversation}"
+    return {"conversation": conversation, "summary": summary, "summarized_count": summarized_count}
+
 def configure_memory(state):
     question = state["question"]
     generation = state["generation"]
+    new_messages = [HumanMessage(content=question), generation]
+    context = build_context(state["messages"] + new_messages, state.get("summary", ""), state.get("summarized_count", 0))
     return {
-        "messages": [HumanMessage(content=question), generation],   # Add generation to our messages_list
+        "messages": new_messages,   # Add generation to our messages_list
         "attempted_generations": 0,   # Reset this value to 0
-        "documents": []    # Reset documents to empty
+        "documents": [],    # Reset documents to empty
+        **context,
     }
 
 graph_builder = StateGraph(GraphState, input=InputState, output=OutputState)
@@ -192,7 +452,9 @@ graph_builder.add_conditional_edges(
     decide_to_generate,
     {
         "some relevant": "generate_response",
-        "none relevant": END
+        "none relevant": END,
+        "supported": "configure_memory",
+        "not supported": "generate_response"
     })
 graph_builder.add_conditional_edges(
     "generate_response",
@@ -203,4 +465,6 @@ graph_builder.add_conditional_edges(
     })
 graph_builder.add_edge("configure_memory", END)
 
-graph = graph_builder.compile()
\ No newline at end of file
+graph = graph_builder.compile()
+
+_import_timer.stop()
@@ -1,12 +1,15 @@
-import ast
+from startup import ImportTimer
+_import_timer = ImportTimer(__name__)
+
 from typing_extensions import TypedDict
 from typing import Annotated, Optional, List
 
 from agents.utils import invoice_graph as invoice_agent
 from react.music_agent import graph as music_agent
-from utils import llm, get_engine_for_chinook_db
+from startup import lazy_resource
+from catalog import get_identity_index
+from utils import llm
 
-from langchain_community.utilities.sql_database import SQLDatabase
 from langgraph.graph import StateGraph, START, END
 
 from langgraph.graph.message import AnyMessage, add_messages
@@ -16,9 +19,6 @@ from langchain_core.messages import SystemMessage
 from langchain_core.runnables import RunnableConfig
 
 
-engine = get_engine_for_chinook_db()
-db = SQLDatabase(engine)
-
 supervisor_prompt = """You are an expert customer support assistant for a digital music store. 
 You are dedicated to providing exceptional service and ensuring customer queries are answered thoroughly. 
 You have a team of subagents that you can use to help answer queries from customers. 
@@ -62,7 +62,10 @@ class UserInput(BaseModel):
     identifier: str = Field(description = "Identifier, which can be a customer ID, email, or phone number.")
 
 
-structured_llm = llm.with_structured_output(schema=UserInput)
+@lazy_resource
+def get_structured_llm():
+    return llm.with_structured_output(schema=UserInput)
+
 structured_system_prompt = """You are a customer service representative responsible for extracting customer identifier.\n 
 Only extract the customer's account information from the message history. 
 If they haven't provided the information yet, return an empty string for the file"""
@@ -80,21 +83,8 @@ def get_customer_id_from_identifier(identifier: str) -> Optional[int]:
     Returns:
         Optional[int]: The CustomerId if found, otherwise None.
     """
-    if identifier.isdigit():
-        return int(identifier)
-    elif identifier[0] == "+":
-        query = f"SELECT CustomerId FROM Customer WHERE Phone = '{identifier}';"
-        result = db.run(query)
-        formatted_result = ast.literal_eval(result)
-        if formatted_result:
-            return formatted_result[0][0]
-    elif "@" in identifier:
-        query = f"SELECT CustomerId FROM Customer WHERE Email = '{identifier}';"
-        result = db.run(query)
-        formatted_result = ast.literal_eval(result)
-        if formatted_result:
-            return formatted_result[0][0]
-    return None 
+    # Dict lookups on normalized email, phone digits and ID; no SQL on the verification path
+    return get_identity_index().resolve(identifier)
 
 
 # Node
@@ -113,7 +103,7 @@ def verify_info(state: State, config: RunnableConfig):
         user_input = state["messages"][-1] 
     
         # Parse for customer ID
-        parsed_info = structured_llm.invoke([SystemMessage(content=structured_system_prompt)] + [user_input])
+        parsed_info = get_structured_llm().invoke([SystemMessage(content=structured_system_prompt)] + [user_input])
     
         # Extract details
         identifier = parsed_info.identifier
@@ -270,4 +260,6 @@ multi_agent.add_edge("load_memory", "multiagent")
 multi_agent.add_edge("multiagent", "create_memory")
 multi_agent.add_edge("create_memory", END)
 # graph = multi_agent.compile(name="multiagent", checkpointer=checkpointer, store=in_memory_store)
-graph = multi_agent.compile(name="assistant")
\ No newline at end of file
+graph = multi_agent.compile(name="assistant")
+
+_import_timer.stop()
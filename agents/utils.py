@@ -1,13 +1,17 @@
-from utils import llm, get_engine_for_chinook_db
-from langchain_community.utilities.sql_database import SQLDatabase
+from startup import ImportTimer
+_import_timer = ImportTimer(__name__)
+
+import json
+from dataclasses import dataclass
+
+from chinook import INVOICE_COLUMNS
+from queries import format_table, parse_cursor, run_statement, take_page
+from utils import llm
 from typing_extensions import TypedDict
-from typing import Annotated, Optional
+from typing import Annotated, List, Optional
 from langgraph.graph.message import AnyMessage, add_messages
 from langgraph.managed.is_last_step import RemainingSteps
 
-engine = get_engine_for_chinook_db()
-db = SQLDatabase(engine)
-
 from langchain_core.tools import tool
 
 class State(TypedDict):
@@ -16,8 +20,34 @@ class State(TypedDict):
     loaded_memory: Optional[str]
     remaining_steps: Optional[RemainingSteps]
 
+@dataclass(slots=True)
+class InvoiceSummary:
+    invoice_count: int
+    total_spent: float
+    invoices: List[tuple]  # INVOICE_COLUMNS, newest first
+    lines_by_unit_price: List[tuple]  # INVOICE_COLUMNS + UnitPrice, highest first
+    support_rep: Optional[tuple]  # FirstName, Title, Email
+
+    def header(self) -> str:
+        return f"{self.invoice_count} invoices, {self.total_spent:.2f} in total."
+
+
+def get_invoice_summary(customer_id: str) -> Optional[InvoiceSummary]:
+    """The customer's precomputed invoice summary: one primary-key read, or None for an unknown customer."""
+    rows = run_statement("invoice_summary_by_customer", customer_id=customer_id).rows
+    if not rows:
+        return None
+    invoice_count, total_spent, invoices, lines, support_rep = rows[0]
+    return InvoiceSummary(
+        invoice_count,
+        float(total_spent),
+        [tuple(row) for row in json.loads(invoices)],
+        [tuple(row) for row in json.loads(lines)],
+        tuple(json.loads(support_rep)) if support_rep else None,
+    )
+
 @tool 
-def get_invoices_by_customer_sorted_by_date(customer_id: str) -> list[dict]:
+def get_invoices_by_customer_sorted_by_date(customer_id: str) -> str:
     """
     Look up all invoices for a customer using their ID.
     The invoices are sorted in descending order by invoice date, which helps when the customer wants to view their most recent/oldest invoice, or if 
@@ -27,13 +57,16 @@ def get_invoices_by_customer_sorted_by_date(customer_id: str) -> list[dict]:
         customer_id (str): customer_id, which serves as the identifier.
     
     Returns:
-        list[dict]: A list of invoices for the customer.
+        str: The customer's invoice count and total spent, then a table of their invoices, one row per invoice.
     """
-    return db.run(f"SELECT * FROM Invoice WHERE CustomerId = {customer_id} ORDER BY InvoiceDate DESC;")
+    summary = get_invoice_summary(customer_id)
+    if summary is None or not summary.invoices:
+        return ""
+    return f"{summary.header()}\n{format_table(INVOICE_COLUMNS, summary.invoices)}"
 
 
 @tool 
-def get_invoices_sorted_by_unit_price(customer_id: str) -> list[dict]:
+def get_invoices_sorted_by_unit_price(customer_id: str, cursor: Optional[str] = None) -> str:
     """
     Use this tool when the customer wants to know the details of one of their invoices based on the unit price/cost of the invoice.
     This tool looks up all invoices for a customer, and sorts the unit price from highest to lowest. In order to find the invoice associated with the customer, 
@@ -41,22 +74,21 @@ def get_invoices_sorted_by_unit_price(customer_id: str) -> list[dict]:
     
     Args:
         customer_id (str): customer_id, which serves as the identifier.
+        cursor (str, optional): The cursor from a previous call's truncation note, to fetch the next page.
     
     Returns:
-        list[dict]: A list of invoices sorted by unit price.
-    """
-    query = f"""
-        SELECT Invoice.*, InvoiceLine.UnitPrice
-        FROM Invoice
-        JOIN InvoiceLine ON Invoice.InvoiceId = InvoiceLine.InvoiceId
-        WHERE Invoice.CustomerId = {customer_id}
-        ORDER BY InvoiceLine.UnitPrice DESC;
+        str: A table of invoices sorted by unit price. Long results are returned one page at a time and end
+        with a truncation note giving the total row count and the cursor for the next page.
     """
-    return db.run(query)
+    summary = get_invoice_summary(customer_id)
+    if summary is None:
+        return ""
+    offset = parse_cursor(cursor)
+    return take_page(INVOICE_COLUMNS + ("UnitPrice",), summary.lines_by_unit_price[offset:], offset).to_text()
 
 
 @tool
-def get_employee_by_invoice_and_customer(invoice_id: str, customer_id: str) -> dict:
+def get_employee_by_invoice_and_customer(invoice_id: str, customer_id: str) -> str:
     """
     This tool will take in an invoice ID and a customer ID and return the employee information associated with the invoice.
 
@@ -65,22 +97,14 @@ def get_employee_by_invoice_and_customer(invoice_id: str, customer_id: str) -> d
         customer_id (str): customer_id, which serves as the identifier.
 
     Returns:
-        dict: Information about the employee associated with the invoice.
+        str: Information about the employee associated with the invoice.
     """
 
-    query = f"""
-        SELECT Employee.FirstName, Employee.Title, Employee.Email
-        FROM Employee
-        JOIN Customer ON Customer.SupportRepId = Employee.EmployeeId
-        JOIN Invoice ON Invoice.CustomerId = Customer.CustomerId
-        WHERE Invoice.InvoiceId = ({invoice_id}) AND Invoice.CustomerId = ({customer_id});
-    """
-    
-    employee_info = db.run(query, include_columns=True)
-    
-    if not employee_info:
+    summary = get_invoice_summary(customer_id)
+    invoice_ids = {str(invoice[0]) for invoice in summary.invoices} if summary else set()
+    if summary is None or summary.support_rep is None or str(invoice_id).strip() not in invoice_ids:
         return f"No employee found for invoice ID {invoice_id} and customer identifier {customer_id}."
-    return employee_info
+    return format_table(("FirstName", "Title", "Email"), [summary.support_rep])
 
 invoice_tools = [get_invoices_by_customer_sorted_by_date, get_invoices_sorted_by_unit_price, get_employee_by_invoice_and_customer]
 
@@ -106,3 +130,5 @@ from langgraph.prebuilt import create_react_agent
 
 # Define the subagent 
 invoice_graph = create_react_agent(llm, tools=invoice_tools, name="invoice_information_subagent",prompt=invoice_subagent_prompt, state_schema=State)
+
+_import_timer.stop()
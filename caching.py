@@ -0,0 +1,257 @@
+"""
+A shared read-through cache for tool results, and single-flight coalescing of identical calls.
+
+The Chinook catalog only changes when the database is rebuilt, so identical catalog tool calls
+return identical text. Decorating a tool function with @cached (under @tool) answers repeated calls
+from one process-wide LRU, keyed on the tool name plus its normalized arguments and bounded by the
+size of the cached results. Entries can expire after a TTL and are dropped whenever chinook reports
+that the data changed.
+
+A cache only helps once a result exists. SingleFlight covers the moment before that: concurrent
+identical calls wait on one underlying call and share its result instead of each running it.
+"""
+import asyncio
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional
+
+from chinook import add_data_change_listener
+
+# NOTE: Configure the tool result cache. A TTL of 0 keeps entries until they are evicted or invalidated.
+TOOL_CACHE_MAX_BYTES = int(os.getenv("TOOL_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+TOOL_CACHE_TTL_SECONDS = float(os.getenv("TOOL_CACHE_TTL_SECONDS", "0"))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+class ToolResultCache:
+    """A thread-safe LRU whose capacity is a number of bytes, with an optional TTL per entry."""
+
+    def __init__(self, max_bytes: int = TOOL_CACHE_MAX_BYTES, ttl_seconds: Optional[float] = TOOL_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds or None
+        self.size_bytes = 0
+        self.stats = CacheStats()
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        """Return (True, value) for a live entry and mark it recently used, else (False, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                self.stats.expirations += 1
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return True, entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return  # Would evict everything else and still not fit
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None):
+        """Drop every entry, or only those whose key matches predicate."""
+        with self._lock:
+            keys = [key for key in self._entries if predicate is None or predicate(key)]
+            for key in keys:
+                self._remove(key)
+            self.stats.invalidations += len(keys)
+
+    def invalidate_tool(self, name: str):
+        self.invalidate(lambda key: key[0] == name)
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self.size_bytes -= size
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.stats.hits + self.stats.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.stats.hits,
+                "misses": self.stats.misses,
+                "hit_rate": self.stats.hits / lookups if lookups else 0.0,
+                "evictions": self.stats.evictions,
+                "expirations": self.stats.expirations,
+                "invalidations": self.stats.invalidations,
+            }
+
+
+tool_cache = ToolResultCache()
+
+# Any rebuild of the catalog makes every cached result suspect
+add_data_change_listener(lambda: tool_cache.invalidate())
+
+
+def normalize_argument(value):
+    """Collapse whitespace and case in strings, so "AC/DC " and "ac/dc" share an entry."""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    return value
+
+
+def cache_key(name: str, signature: inspect.Signature, args: tuple, kwargs: dict) -> tuple:
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return (name,) + tuple((arg, normalize_argument(value)) for arg, value in bound.arguments.items())
+
+
+def cached(fn=None, *, cache: ToolResultCache = tool_cache):
+    """Read-through caching for a tool function; the signature and docstring are kept for @tool."""
+    if fn is None:
+        return functools.partial(cached, cache=cache)
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = cache_key(fn.__name__, signature, args, kwargs)
+        found, value = cache.get(key)
+        if found:
+            return value
+        value = fn(*args, **kwargs)
+        cache.put(key, value)
+        return value
+
+    return wrapper
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key: the first caller runs the call, callers arriving while it
+    is in flight wait for it and get the same result (or exception). Nothing is kept afterwards.
+    do() is for threads, ado() for coroutines; the two keep separate in-flight tables.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def ado(self, key: Hashable, afn: Callable[[], Any]):
+        # Tasks belong to one event loop, so flights are shared per loop
+        key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            task = self._async_flights.get(key)
+            if task is None:
+                # The call runs in its own task, so it outlives whichever caller started it
+                task = self._async_flights[key] = asyncio.ensure_future(afn())
+                task.add_done_callback(functools.partial(self._land, key))
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        # shield: a cancelled caller, the first one included, must not cancel the shared result for everyone else
+        return await asyncio.shield(task)
+
+    def _land(self, key: Hashable, task: asyncio.Task):
+        with self._lock:
+            if self._async_flights.get(key) is task:
+                del self._async_flights[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved, so a flight whose callers all left doesn't log a warning
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights) + len(self._async_flights)}
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """The process-wide SingleFlight registered under name."""
+    with _flights_lock:
+        if name not in _flights:
+            _flights[name] = SingleFlight(name)
+        return _flights[name]
+
+
+def coalesced(fn):
+    """Single-flight a tool function: concurrent calls with the same normalized arguments run it once."""
+    signature = inspect.signature(fn)
+    flight = get_single_flight(fn.__name__)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = cache_key(fn.__name__, signature, args, kwargs)
+        return flight.do(key, lambda: fn(*args, **kwargs))
+
+    return wrapper
+
+
+def get_cache_metrics() -> dict:
+    return tool_cache.metrics()
+
+
+def get_single_flight_metrics() -> dict:
+    with _flights_lock:
+        flights = list(_flights.values())
+    return {flight.name: flight.metrics() for flight in flights}
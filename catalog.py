@@ -0,0 +1,198 @@
+"""
+In-memory indexes over the Chinook catalog, built once from the database and rebuilt when it changes.
+
+TrigramIndex resolves misspelled or partial artist, album and track names in one lookup, so a
+tool can fall back to the closest real name itself instead of the model retrying spellings over
+several turns. GenreSummary keeps a few representative songs per genre, so a genre lookup is a dict
+read instead of a join over every track. IdentityIndex resolves a customer ID, email or phone number
+to a CustomerId with dict lookups.
+"""
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from chinook import add_data_change_listener
+from queries import run_statement
+from startup import lazy_resource
+
+# NOTE: Configure how close a name must be (trigram Jaccard similarity, 0-1) for tools to use it
+# in place of a name that matched nothing
+FUZZY_MIN_SIMILARITY = 0.3
+
+# Representative songs kept per genre, one per artist
+GENRE_SUMMARY_SIZE = 8
+
+NON_ALPHANUMERIC = re.compile(r"[\W_]+")
+NON_DIGIT = re.compile(r"\D+")
+
+
+def normalize_name(text: str) -> str:
+    return " ".join(NON_ALPHANUMERIC.sub(" ", text.casefold()).split())
+
+
+def trigrams(text: str) -> set:
+    """Character trigrams of the normalized text, padded so word starts and ends carry weight."""
+    padded = f"  {normalize_name(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass(slots=True)
+class NameMatch:
+    kind: str
+    id: int
+    name: str
+    similarity: float
+
+
+class TrigramIndex:
+    """
+    An inverted index from trigram to the rows containing it. A lookup gathers the postings of the
+    query's trigrams and counts shared trigrams per row with one bincount, then scores rows by
+    Jaccard similarity |q & t| / |q | t|.
+    """
+
+    def __init__(self, kind: str, entries: Sequence[Tuple[int, str]]):
+        self.kind = kind
+        self.ids = np.array([entry_id for entry_id, _ in entries], dtype=np.int64)
+        self.names = [name or "" for _, name in entries]
+        postings: Dict[str, List[int]] = {}
+        sizes = np.zeros(len(entries), dtype=np.int32)
+        for row, name in enumerate(self.names):
+            grams = trigrams(name)
+            sizes[row] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(row)
+        self.sizes = sizes
+        self.postings = {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, query: str, limit: int = 5, min_similarity: float = 0.0) -> List[NameMatch]:
+        grams = trigrams(query)
+        hits = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not hits:
+            return []
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.names))
+        similarity = shared / (len(grams) + self.sizes - shared)
+        limit = min(limit, len(similarity))
+        top = np.argpartition(-similarity, limit - 1)[:limit]
+        top = top[np.argsort(-similarity[top], kind="stable")]
+        return [
+            NameMatch(self.kind, int(self.ids[row]), self.names[row], float(similarity[row]))
+            for row in top
+            if similarity[row] > 0 and similarity[row] >= min_similarity
+        ]
+
+
+CATALOG_SOURCES = {
+    "artist": "artist_names",
+    "album": "album_titles",
+    "track": "track_names",
+}
+
+
+@lazy_resource
+def get_name_index(kind: str) -> TrigramIndex:
+    return TrigramIndex(kind, run_statement(CATALOG_SOURCES[kind]).rows)
+
+
+add_data_change_listener(get_name_index.reset)
+
+
+def fuzzy_search(
+    name: str, kinds: Sequence[str] = tuple(CATALOG_SOURCES), limit: int = 5, min_similarity: float = 0.1
+) -> List[NameMatch]:
+    """The closest catalog names across kinds, best first."""
+    matches = [match for kind in kinds for match in get_name_index(kind).search(name, limit, min_similarity)]
+    return sorted(matches, key=lambda match: match.similarity, reverse=True)[:limit]
+
+
+def resolve_name(kind: str, name: str, min_similarity: float = FUZZY_MIN_SIMILARITY):
+    """The single closest name of this kind, or None when nothing is close enough."""
+    matches = get_name_index(kind).search(name, limit=1, min_similarity=min_similarity)
+    return matches[0] if matches else None
+
+
+class GenreSummary:
+    """
+    For each genre, one song by each of its GENRE_SUMMARY_SIZE artists with the most tracks in it.
+    Genres are looked up by normalized name; a name that isn't a genre falls back to a substring
+    match over the genre names (there are only a couple dozen), as the old LIKE query did.
+    """
+
+    def __init__(self, rows: Sequence[Tuple[str, str, str]], size: int = GENRE_SUMMARY_SIZE):
+        tracks_by_genre = defaultdict(list)
+        for genre, song, artist in rows:
+            tracks_by_genre[genre].append((song, artist))
+
+        self.genres: Dict[str, List[Tuple[str, str]]] = {}
+        for genre, tracks in tracks_by_genre.items():
+            counts = Counter(artist for _, artist in tracks)
+            first_song = {}
+            for song, artist in tracks:
+                first_song.setdefault(artist, song)
+            top = sorted(first_song, key=lambda artist: (-counts[artist], artist or ""))[:size]
+            self.genres[normalize_name(genre)] = [(first_song[artist], artist) for artist in top]
+        self.size = size
+
+    def lookup(self, genre: str) -> List[Tuple[str, str]]:
+        key = normalize_name(genre)
+        if key in self.genres:
+            return self.genres[key]
+        songs, artists = [], set()
+        for name, tracks in self.genres.items():
+            if key and key in name:
+                for song, artist in tracks:
+                    if artist not in artists:
+                        artists.add(artist)
+                        songs.append((song, artist))
+        return songs[:self.size]
+
+
+@lazy_resource
+def get_genre_summary() -> GenreSummary:
+    return GenreSummary(run_statement("genre_tracks").rows)
+
+
+add_data_change_listener(get_genre_summary.reset)
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().casefold()
+
+
+def normalize_phone(phone: str) -> str:
+    """Digits only, so "+1 (204) 452-6452" and "+1 204 452 6452" are the same number."""
+    return NON_DIGIT.sub("", phone)
+
+
+class IdentityIndex:
+    """Hash maps from customer ID, normalized email and normalized phone number to CustomerId."""
+
+    def __init__(self, rows: Sequence[Tuple[int, Optional[str], Optional[str]]]):
+        self.ids = {str(customer_id): customer_id for customer_id, _, _ in rows}
+        self.emails = {normalize_email(email): customer_id for customer_id, email, _ in rows if email}
+        self.phones = {normalize_phone(phone): customer_id for customer_id, _, phone in rows if phone}
+        self.phones.pop("", None)
+
+    def resolve(self, identifier: str) -> Optional[int]:
+        identifier = identifier.strip()
+        if not identifier:
+            return None
+        if "@" in identifier:
+            return self.emails.get(normalize_email(identifier))
+        if identifier.isdigit() and identifier.lstrip("0") in self.ids:
+            return self.ids[identifier.lstrip("0")]
+        return self.phones.get(normalize_phone(identifier))
+
+
+@lazy_resource
+def get_identity_index() -> IdentityIndex:
+    return IdentityIndex(run_statement("customer_identities").rows)
+
+
+add_data_change_listener(get_identity_index.reset)
@@ -1,10 +1,18 @@
+from startup import ImportTimer
+_import_timer = ImportTimer(__name__)
+
+from caching import get_single_flight
 from utils import get_langgraph_docs_retriever, llm
 from langchain.schema import Document
 from typing import List
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 
-retriever = get_langgraph_docs_retriever()
+def get_retriever():
+    return get_langgraph_docs_retriever(k=4, fetch_k=20, lambda_mult=0.5)
+
+# Concurrent runs asking the same question share one retrieval
+retrieval_flight = get_single_flight("rag_chain.retrieve_documents")
 
 class GraphState(TypedDict):
     """
@@ -21,6 +29,7 @@ class InputState(TypedDict):
     question: str
 
 from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
 
 def retrieve_documents(state: GraphState):
     """
@@ -31,8 +40,14 @@ def retrieve_documents(state: GraphState):
     """
     print("---RETRIEVE DOCUMENTS---")
     question = state["question"]
-    documents = retriever.invoke(question)
-    return {"documents": documents}
+    documents = retrieval_flight.do(question.strip(), lambda: get_retriever().invoke(question))
+    return {"documents": list(documents)}
+
+async def aretrieve_documents(state: GraphState):
+    print("---RETRIEVE DOCUMENTS---")
+    question = state["question"]
+    documents = await retrieval_flight.ado(question.strip(), lambda: get_retriever().ainvoke(question))
+    return {"documents": list(documents)}
 
 RAG_PROMPT = """You are an assistant for question-answering tasks. 
 Use the following pieces of retrieved context to answer the question. 
@@ -61,10 +76,12 @@ def generate_response(state: GraphState):
     return {"generation": generation}
 
 graph_builder = StateGraph(GraphState, input=InputState)
-graph_builder.add_node("retrieve_documents", retrieve_documents)
+graph_builder.add_node("retrieve_documents", RunnableLambda(retrieve_documents, afunc=aretrieve_documents))
 graph_builder.add_node("generate_response", generate_response)
 graph_builder.add_edge(START, "retrieve_documents")
 graph_builder.add_edge("retrieve_documents", "generate_response")
 graph_builder.add_edge("generate_response", END)
 
-graph = graph_builder.compile()
\ No newline at end of file
+graph = graph_builder.compile()
+
+_import_timer.stop()
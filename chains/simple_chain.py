@@ -1,11 +1,12 @@
-from utils import get_langgraph_docs_retriever, llm
+from startup import ImportTimer
+_import_timer = ImportTimer(__name__)
+
+from utils import llm
 from langchain.schema import Document
 from typing import List
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 
-retriever = get_langgraph_docs_retriever()
-
 class GraphState(TypedDict):
     """
     Attributes:
@@ -49,4 +50,6 @@ graph_builder.add_edge(START, "lowercase")
 graph_builder.add_edge("lowercase", "capitalize")
 graph_builder.add_edge("capitalize", END)
 
-graph = graph_builder.compile()
\ No newline at end of file
+graph = graph_builder.compile()
+
+_import_timer.stop()
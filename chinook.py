@@ -0,0 +1,344 @@
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import requests
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+CHINOOK_SQL_URL = "https://raw.githubusercontent.com/lerocha/chinook-database/master/ChinookDatabase/DataSources/Chinook_Sqlite.sql"
+
+# NOTE: Configure where the Chinook database lives
+# - "file": build the database once into CHINOOK_DB_PATH, then open it read-only on every start
+# - "memory": download the script into a shared in-memory database on every start
+CHINOOK_DB_MODE = os.getenv("CHINOOK_DB_MODE", "file")
+CHINOOK_DB_PATH = os.getenv("CHINOOK_DB_PATH", "chinook.sqlite")
+
+# Bump whenever build_chinook_db changes what it writes, so existing files are rebuilt
+CHINOOK_DB_VERSION = 3
+
+# Let SQLite read the database file through a memory map instead of read() calls
+CHINOOK_MMAP_SIZE = 256 * 1024 * 1024
+
+# Prepared statements each pooled connection keeps, keyed by SQL text (see queries.py)
+STATEMENT_CACHE_SIZE = 256
+
+# NOTE: Configure the shared pool of read-only connections, one pool per process
+CHINOOK_POOL_SIZE = int(os.getenv("CHINOOK_POOL_SIZE", "8"))
+CHINOOK_POOL_TIMEOUT = 30
+
+
+_data_change_listeners = []
+
+
+def add_data_change_listener(callback):
+    """Register callback() to run whenever the Chinook data is rebuilt, e.g. to drop derived caches."""
+    _data_change_listeners.append(callback)
+
+
+def notify_data_changed():
+    for callback in list(_data_change_listeners):
+        callback()
+
+
+def download_chinook_script() -> str:
+    response = requests.get(CHINOOK_SQL_URL)
+    response.raise_for_status()
+    return response.text
+
+
+# Covering B-tree indexes for the joins and filters the SQL tools run
+SEARCH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS IX_AlbumArtistTitle ON Album (ArtistId, Title)",
+    "CREATE INDEX IF NOT EXISTS IX_TrackAlbumName ON Track (AlbumId, Name)",
+    "CREATE INDEX IF NOT EXISTS IX_TrackGenreAlbum ON Track (GenreId, AlbumId, Name)",
+    "CREATE INDEX IF NOT EXISTS IX_InvoiceCustomerDate ON Invoice (CustomerId, InvoiceDate)",
+    "CREATE INDEX IF NOT EXISTS IX_InvoiceLineInvoicePrice ON InvoiceLine (InvoiceId, UnitPrice)",
+    "CREATE INDEX IF NOT EXISTS IX_CustomerEmail ON Customer (Email)",
+    "CREATE INDEX IF NOT EXISTS IX_CustomerPhone ON Customer (Phone)",
+    "CREATE INDEX IF NOT EXISTS IX_CustomerSupportRep ON Customer (SupportRepId)",
+]
+
+# FTS5 tables over catalog names: (search table, content table, id column, text column).
+# The trigram tokenizer makes `Name LIKE '%x%'` on the search table an index lookup instead of a
+# full scan, with the same case-insensitive substring semantics the tools had before.
+SEARCH_TABLES = [
+    ("ArtistSearch", "Artist", "ArtistId", "Name"),
+    ("AlbumSearch", "Album", "AlbumId", "Title"),
+    ("TrackSearch", "Track", "TrackId", "Name"),
+]
+
+
+def create_search_indexes(connection: sqlite3.Connection):
+    """Create the B-tree indexes and FTS5 search tables, with triggers keeping the latter in sync."""
+    tokenizer = "trigram" if sqlite3.sqlite_version_info >= (3, 34, 0) else "unicode61"
+    for statement in SEARCH_INDEXES:
+        connection.execute(statement)
+    for search_table, table, id_column, text_column in SEARCH_TABLES:
+        connection.executescript(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {search_table} USING fts5(
+                {text_column}, content='{table}', content_rowid='{id_column}', tokenize='{tokenizer}'
+            );
+            INSERT INTO {search_table}({search_table}) VALUES ('rebuild');
+            CREATE TRIGGER IF NOT EXISTS {search_table}Insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {search_table}(rowid, {text_column}) VALUES (new.{id_column}, new.{text_column});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {search_table}Delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {search_table}({search_table}, rowid, {text_column}) VALUES ('delete', old.{id_column}, old.{text_column});
+            END;
+            CREATE TRIGGER IF NOT EXISTS {search_table}Update AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {search_table}({search_table}, rowid, {text_column}) VALUES ('delete', old.{id_column}, old.{text_column});
+                INSERT INTO {search_table}(rowid, {text_column}) VALUES (new.{id_column}, new.{text_column});
+            END;
+        """)
+    connection.execute("ANALYZE")
+    connection.commit()
+
+
+# One row per customer with everything the invoice tools read, as JSON arrays in the tools' column order
+INVOICE_COLUMNS = (
+    "InvoiceId", "CustomerId", "InvoiceDate", "BillingAddress", "BillingCity",
+    "BillingState", "BillingCountry", "BillingPostalCode", "Total",
+)
+_invoice_row = "json_array(" + ", ".join(f"Invoice.{column}" for column in INVOICE_COLUMNS)
+
+REFRESH_INVOICE_SUMMARY = f"""
+    INSERT OR REPLACE INTO CustomerInvoiceSummary
+    SELECT
+        Customer.CustomerId,
+        (SELECT COUNT(*) FROM Invoice WHERE Invoice.CustomerId = Customer.CustomerId),
+        (SELECT COALESCE(SUM(Total), 0) FROM Invoice WHERE Invoice.CustomerId = Customer.CustomerId),
+        (SELECT COALESCE(json_group_array(json(InvoiceRow)), '[]') FROM (
+            SELECT {_invoice_row}) AS InvoiceRow FROM Invoice
+            WHERE Invoice.CustomerId = Customer.CustomerId
+            ORDER BY Invoice.InvoiceDate DESC, Invoice.InvoiceId
+        )),
+        (SELECT COALESCE(json_group_array(json(LineRow)), '[]') FROM (
+            SELECT {_invoice_row}, InvoiceLine.UnitPrice) AS LineRow FROM Invoice
+            JOIN InvoiceLine ON Invoice.InvoiceId = InvoiceLine.InvoiceId
+            WHERE Invoice.CustomerId = Customer.CustomerId
+            ORDER BY InvoiceLine.UnitPrice DESC, InvoiceLine.InvoiceLineId
+        )),
+        (SELECT json_array(Employee.FirstName, Employee.Title, Employee.Email)
+            FROM Employee WHERE Employee.EmployeeId = Customer.SupportRepId)
+    FROM Customer
+    WHERE {{customers}};
+"""
+
+# (trigger, event, customers whose summary it refreshes)
+INVOICE_SUMMARY_TRIGGERS = [
+    ("InvoiceInsert", "INSERT ON Invoice", "Customer.CustomerId = new.CustomerId"),
+    ("InvoiceUpdate", "UPDATE ON Invoice", "Customer.CustomerId IN (old.CustomerId, new.CustomerId)"),
+    ("InvoiceDelete", "DELETE ON Invoice", "Customer.CustomerId = old.CustomerId"),
+    ("InvoiceLineInsert", "INSERT ON InvoiceLine",
+     "Customer.CustomerId IN (SELECT CustomerId FROM Invoice WHERE InvoiceId = new.InvoiceId)"),
+    ("InvoiceLineUpdate", "UPDATE ON InvoiceLine",
+     "Customer.CustomerId IN (SELECT CustomerId FROM Invoice WHERE InvoiceId IN (old.InvoiceId, new.InvoiceId))"),
+    ("InvoiceLineDelete", "DELETE ON InvoiceLine",
+     "Customer.CustomerId IN (SELECT CustomerId FROM Invoice WHERE InvoiceId = old.InvoiceId)"),
+    ("CustomerSupportRep", "UPDATE OF SupportRepId ON Customer", "Customer.CustomerId = new.CustomerId"),
+    ("EmployeeContact", "UPDATE OF FirstName, Title, Email ON Employee", "Customer.SupportRepId = new.EmployeeId"),
+]
+
+
+def create_invoice_summary(connection: sqlite3.Connection):
+    """
+    Materialize CustomerInvoiceSummary for every customer, and add triggers that recompute just the
+    affected customer's row whenever an invoice, invoice line, support rep or rep's contact changes.
+    """
+    connection.executescript(f"""
+        CREATE TABLE IF NOT EXISTS CustomerInvoiceSummary (
+            CustomerId INTEGER PRIMARY KEY,
+            InvoiceCount INTEGER NOT NULL,
+            TotalSpent NUMERIC NOT NULL,
+            Invoices TEXT NOT NULL,
+            LinesByUnitPrice TEXT NOT NULL,
+            SupportRep TEXT
+        );
+        {REFRESH_INVOICE_SUMMARY.format(customers="1")}
+    """)
+    for name, event, customers in INVOICE_SUMMARY_TRIGGERS:
+        connection.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS InvoiceSummary{name} AFTER {event} BEGIN
+                {REFRESH_INVOICE_SUMMARY.format(customers=customers)}
+            END;
+        """)
+    connection.commit()
+
+
+def build_chinook_db(path: str = CHINOOK_DB_PATH) -> dict:
+    """
+    Download the Chinook script and materialize it into a SQLite file.
+
+    The build is written to a temp file and atomically moved into place, so concurrent
+    workers or an interrupted build never leave a half-written database behind. The
+    build version and the sha256 of the source script are recorded in ChinookBuild.
+    """
+    sql_script = download_chinook_script()
+    checksum = hashlib.sha256(sql_script.encode("utf-8")).hexdigest()
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.executescript(sql_script)
+        create_search_indexes(connection)
+        create_invoice_summary(connection)
+        connection.execute("CREATE TABLE ChinookBuild (Version INTEGER NOT NULL, SourceSha256 TEXT NOT NULL)")
+        connection.execute("INSERT INTO ChinookBuild VALUES (?, ?)", (CHINOOK_DB_VERSION, checksum))
+        connection.commit()
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    notify_data_changed()
+    print(f"Built Chinook database at {path} (version {CHINOOK_DB_VERSION}, sha256 {checksum[:12]})")
+    return {"version": CHINOOK_DB_VERSION, "source_sha256": checksum}
+
+
+def read_build_info(path: str = CHINOOK_DB_PATH) -> Optional[dict]:
+    """The recorded build version and source checksum, or None if the file is missing or unversioned."""
+    if not os.path.exists(path):
+        return None
+    try:
+        connection = connect_read_only(path)
+        try:
+            row = connection.execute("SELECT Version, SourceSha256 FROM ChinookBuild").fetchone()
+        finally:
+            connection.close()
+    except sqlite3.DatabaseError:
+        return None
+    if row is None:
+        return None
+    return {"version": row[0], "source_sha256": row[1]}
+
+
+def ensure_chinook_db(path: str = CHINOOK_DB_PATH) -> dict:
+    """Build the database file unless an up-to-date one already exists. Needs no network once built."""
+    info = read_build_info(path)
+    if info is not None and info["version"] == CHINOOK_DB_VERSION:
+        return info
+    print("Chinook database missing or out of date, building it...")
+    return build_chinook_db(path)
+
+
+def connect_read_only(path: str = CHINOOK_DB_PATH) -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        f"file:{path}?mode=ro", uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+    )
+    connection.execute(f"PRAGMA mmap_size = {CHINOOK_MMAP_SIZE}")
+    return connection
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that also tracks how many callers wait for a connection and for how long."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.checkouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        with self._metrics_lock:
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._metrics_lock:
+                self.waiting -= 1
+                self.checkouts += 1
+                self.total_wait_seconds += elapsed
+                self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+
+    def metrics(self) -> dict:
+        with self._metrics_lock:
+            return {
+                "pool_size": self.size(),
+                "checked_out": self.checkedout(),
+                "idle": self.checkedin(),
+                "waiting": self.waiting,
+                "peak_waiting": self.peak_waiting,
+                "checkouts": self.checkouts,
+                "avg_wait_ms": 1000 * self.total_wait_seconds / self.checkouts if self.checkouts else 0.0,
+                "max_wait_ms": 1000 * self.max_wait_seconds,
+            }
+
+
+def _pooled_engine(connect):
+    """An engine over a fixed-size pool of connections made by connect()."""
+    return create_engine(
+        "sqlite://",
+        creator=connect,
+        poolclass=InstrumentedQueuePool,
+        pool_size=CHINOOK_POOL_SIZE,
+        max_overflow=0,
+        pool_timeout=CHINOOK_POOL_TIMEOUT,
+    )
+
+
+_memory_db_counter = itertools.count()
+
+
+def create_in_memory_engine():
+    """Pull sql file, populate a shared-cache in-memory database, and create a pooled engine over it."""
+    uri = f"file:chinook-{os.getpid()}-{next(_memory_db_counter)}?mode=memory&cache=shared"
+    # The database lives as long as at least one connection to it is open, so keep this one
+    keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    keeper.executescript(download_chinook_script())
+    create_search_indexes(keeper)
+    create_invoice_summary(keeper)
+    notify_data_changed()
+
+    def connect():
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        connection.execute("PRAGMA query_only = 1")
+        return connection
+
+    engine = _pooled_engine(connect)
+    engine.keeper_connection = keeper
+    return engine
+
+
+def create_file_engine(path: str = CHINOOK_DB_PATH):
+    """Open the materialized database file read-only, building it first if needed."""
+    ensure_chinook_db(path)
+    return _pooled_engine(lambda: connect_read_only(path))
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_shared_engine(mode: str = CHINOOK_DB_MODE, path: str = CHINOOK_DB_PATH):
+    """
+    The process-wide engine for the Chinook database. Every graph module shares it, so concurrent
+    tool calls draw from one pool of read-only connections instead of each module serializing on
+    its own single connection. Keyed by pid so a forked worker builds its own pool.
+    """
+    key = (os.getpid(), mode, path)
+    with _engines_lock:
+        if key not in _engines:
+            if mode == "memory":
+                _engines[key] = create_in_memory_engine()
+            elif mode == "file":
+                _engines[key] = create_file_engine(path)
+            else:
+                raise ValueError(f"Unknown Chinook database mode: {mode}")
+        return _engines[key]
+
+
+def get_engine_metrics(mode: str = CHINOOK_DB_MODE, path: str = CHINOOK_DB_PATH) -> dict:
+    """Pool size, connections in use, callers waiting (queue depth) and wait times for the shared engine."""
+    return get_shared_engine(mode, path).pool.metrics()
@@ -0,0 +1,128 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import zlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+TOKEN_PATTERN = re.compile(r"\w\w+")
+
+
+def get_model_name(embeddings: Embeddings) -> str:
+    """Best-effort name for an embedding model, used to keep vectors from different models apart."""
+    for attr in ("model", "model_name"):
+        name = getattr(embeddings, attr, None)
+        if isinstance(name, str) and name:
+            return name
+    return type(embeddings).__name__
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a persistent, content-addressed cache of document vectors.
+
+    Vectors are keyed by sha256(model name + chunk text) and stored as raw float32 bytes in a
+    SQLite file, so re-building an index (or re-chunking into the same chunks) only pays for
+    text that has never been embedded before. Queries are passed straight through.
+    """
+
+    def __init__(self, underlying: Embeddings, cache_path: str = "embedding-cache.sqlite"):
+        self.underlying = underlying
+        self.model_name = get_model_name(underlying)
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None  # Opened on first embed_documents, so constructing this touches no files
+
+    def _connection(self) -> sqlite3.Connection:
+        # Callers hold self._lock
+        if self._conn is None:
+            conn = sqlite3.connect(self.cache_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> dict:
+        found = {}
+        # Stay well under SQLite's limit on bound parameters
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._connection().execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            found.update(rows)
+        return found
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(list(set(keys)))
+
+        missing = {}  # key -> text, de-duplicated so repeated chunks are embedded once
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            rows = [
+                (key, np.asarray(vector, dtype=np.float32).tobytes())
+                for key, vector in zip(missing, vectors)
+            ]
+            with self._lock:
+                conn = self._connection()
+                conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+                conn.commit()
+            cached.update(rows)
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return [np.frombuffer(cached[key], dtype=np.float32).tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local, deterministic embeddings using the hashing trick.
+
+    Lowercased word unigrams and bigrams are hashed with crc32 into a fixed number of buckets and
+    the counts are L2-normalized. Unlike scikit-learn's HashingVectorizer (signed murmurhash3 over
+    unigrams by default) there is no alternate sign, so colliding features add up rather than cancel.
+    There is no model to fit or download and a query embeds in tens of microseconds on CPU. Quality is lexical rather than semantic, which suits keyword-heavy
+    questions, offline index builds and tests.
+    """
+
+    def __init__(self, n_features: int = 2048):
+        self.n_features = n_features
+        self.model = f"hashing-{n_features}"
+
+    def vectorize(self, text: str) -> np.ndarray:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        buckets = [zlib.crc32(feature.encode("utf-8")) % self.n_features for feature in features]
+        vector = np.bincount(buckets, minlength=self.n_features).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vectorize(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.vectorize(text).tolist()
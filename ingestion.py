@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+# A loader takes a URL and returns the documents found at it
+Loader = Callable[[str], List[Document]]
+
+
+def web_loader(url: str) -> List[Document]:
+    """Fetch a page over HTTP."""
+    from langchain_community.document_loaders import WebBaseLoader
+    return WebBaseLoader(url).load()
+
+
+def url_to_filename(url: str) -> str:
+    """Map a docs URL to a flat filename, e.g. <host>/langgraph/concepts/low_level/ -> langgraph_concepts_low_level"""
+    path = url.split("://", 1)[-1].split("/", 1)[-1].strip("/")
+    return path.replace("/", "_") or "index"
+
+
+def make_local_file_loader(directory: str) -> Loader:
+    """
+    Build a loader that reads pre-downloaded pages from a directory instead of the network.
+    Each URL is looked up as <directory>/<url_to_filename(url)>.html (or .txt), so ingestion
+    can be benchmarked offline against a fixed snapshot of the docs.
+    """
+    root = Path(directory)
+
+    def load(url: str) -> List[Document]:
+        name = url_to_filename(url)
+        for path in (root / f"{name}.html", root / f"{name}.txt"):
+            if path.exists():
+                text = path.read_text(encoding="utf-8")
+                if path.suffix == ".html":
+                    from bs4 import BeautifulSoup
+                    text = BeautifulSoup(text, "html.parser").get_text()
+                return [Document(page_content=text, metadata={"source": url})]
+        raise FileNotFoundError(f"No local copy of {url} in {directory}")
+
+    return load
+
+
+def format_failed_urls(urls: Sequence[str]) -> str:
+    return f"; {len(urls)} failed: {', '.join(urls)}" if urls else ""
+
+
+@dataclass
+class IngestionReport:
+    """Timings (in seconds) and counts for a single ingestion run."""
+    documents: int = 0
+    chunks: int = 0
+    batches: int = 0
+    fetch_seconds: float = 0.0     # Summed across workers, so it can exceed total_seconds
+    split_seconds: float = 0.0
+    embed_seconds: float = 0.0
+    total_seconds: float = 0.0
+    failed_urls: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        return (
+            f"Ingested {self.documents} documents -> {self.chunks} chunks in {self.batches} batches "
+            f"(fetch {self.fetch_seconds:.2f}s, split {self.split_seconds:.2f}s, "
+            f"embed {self.embed_seconds:.2f}s, total {self.total_seconds:.2f}s)"
+            + format_failed_urls(self.failed_urls)
+        )
+
+
+def fetch_documents(
+    urls: Sequence[str],
+    loader: Loader = web_loader,
+    max_workers: int = 8,
+    report: IngestionReport = None,
+) -> Iterator[Tuple[str, List[Document]]]:
+    """
+    Fetch URLs with a bounded thread pool, yielding (url, documents) as each one completes.
+    Failed URLs are recorded on the report and skipped.
+    """
+    def timed_load(url):
+        started = time.perf_counter()
+        docs = loader(url)
+        return docs, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(timed_load, url): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                docs, elapsed = future.result()
+            except Exception as e:
+                print(f"Failed to load {url}: {e}")
+                if report is not None:
+                    report.failed_urls.append(url)
+                continue
+            if report is not None:
+                report.fetch_seconds += elapsed
+                report.documents += len(docs)
+            yield url, docs
+
+
+def ingest_documents(
+    urls: Sequence[str],
+    vectorstore,
+    text_splitter,
+    loader: Loader = web_loader,
+    max_workers: int = 8,
+    batch_size: int = 64,
+) -> IngestionReport:
+    """
+    Fetch, chunk and index documents as a pipeline: pages are fetched concurrently, each page is
+    split as soon as it arrives, and chunks are sent to the vectorstore in fixed-size batches.
+    """
+    report = IngestionReport()
+    started = time.perf_counter()
+    pending: List[Document] = []
+
+    def flush(batch):
+        embed_started = time.perf_counter()
+        vectorstore.add_documents(batch)
+        report.embed_seconds += time.perf_counter() - embed_started
+        report.batches += 1
+
+    for _, docs in fetch_documents(urls, loader=loader, max_workers=max_workers, report=report):
+        split_started = time.perf_counter()
+        chunks = text_splitter.split_documents(docs)
+        report.split_seconds += time.perf_counter() - split_started
+        report.chunks += len(chunks)
+        pending.extend(chunks)
+        while len(pending) >= batch_size:
+            flush(pending[:batch_size])
+            pending = pending[batch_size:]
+
+    if pending:
+        flush(pending)
+    report.total_seconds = time.perf_counter() - started
+    return report
+
+
+@dataclass
+class SyncReport:
+    """What an incremental sync changed."""
+    unchanged_urls: int = 0
+    changed_urls: int = 0
+    removed_urls: int = 0
+    chunks_added: int = 0
+    chunks_deleted: int = 0
+    total_seconds: float = 0.0
+    failed_urls: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        return (
+            f"Synced docs: {self.changed_urls} changed, {self.unchanged_urls} unchanged, "
+            f"{self.removed_urls} removed; +{self.chunks_added}/-{self.chunks_deleted} chunks "
+            f"in {self.total_seconds:.2f}s"
+            + format_failed_urls(self.failed_urls)
+        )
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_ids_for(url: str, chunks: List[Document]) -> List[str]:
+    """
+    Deterministic chunk IDs derived from the URL and chunk text. A chunk that survives an edit
+    elsewhere on the page keeps its ID, so it is neither deleted nor re-embedded.
+    """
+    seen: Dict[str, int] = {}
+    ids = []
+    for chunk in chunks:
+        base = _sha256(f"{url}\0{chunk.page_content}")[:32]
+        occurrence = seen.get(base, 0)
+        seen[base] = occurrence + 1
+        ids.append(base if occurrence == 0 else f"{base}-{occurrence}")
+    return ids
+
+
+def load_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(path: str, manifest: dict):
+    # Write to a temp file first so a crash mid-write never leaves a truncated manifest
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def sync_documents(
+    urls: Sequence[str],
+    vectorstore,
+    text_splitter,
+    manifest_path: str,
+    loader: Loader = web_loader,
+    max_workers: int = 8,
+    batch_size: int = 64,
+) -> SyncReport:
+    """
+    Incrementally bring a vectorstore in line with the given URLs.
+
+    The manifest records, per URL, a hash of the page content and the IDs of its chunks. Pages
+    whose hash is unchanged are skipped; for changed pages only new chunks are upserted and
+    stale ones deleted; URLs no longer in the list have all their chunks deleted. Embedding cost
+    is therefore proportional to what changed, not to the size of the corpus.
+    """
+    report = SyncReport()
+    fetch_report = IngestionReport()
+    started = time.perf_counter()
+    manifest = load_manifest(manifest_path)
+    pending_docs: List[Document] = []
+    pending_ids: List[str] = []
+
+    def flush():
+        vectorstore.add_documents(pending_docs[:batch_size], ids=pending_ids[:batch_size])
+        del pending_docs[:batch_size]
+        del pending_ids[:batch_size]
+
+    for url, docs in fetch_documents(urls, loader=loader, max_workers=max_workers, report=fetch_report):
+        content_hash = _sha256("\0".join(doc.page_content for doc in docs))
+        previous = manifest.get(url)
+        if previous and previous["hash"] == content_hash:
+            report.unchanged_urls += 1
+            continue
+
+        chunks = text_splitter.split_documents(docs)
+        ids = chunk_ids_for(url, chunks)
+        old_ids = set(previous["chunk_ids"]) if previous else set()
+        new_ids = set(ids)
+        for chunk, chunk_id in zip(chunks, ids):
+            if chunk_id not in old_ids:
+                pending_docs.append(chunk)
+                pending_ids.append(chunk_id)
+        stale = list(old_ids - new_ids)
+        if stale:
+            vectorstore.delete(ids=stale)
+        report.changed_urls += 1
+        report.chunks_added += len(new_ids - old_ids)
+        report.chunks_deleted += len(stale)
+        manifest[url] = {"hash": content_hash, "chunk_ids": ids}
+        while len(pending_docs) >= batch_size:
+            flush()
+
+    while pending_docs:
+        flush()
+
+    fetched = set(urls)
+    for url in [url for url in manifest if url not in fetched]:
+        stale = manifest.pop(url)["chunk_ids"]
+        if stale:
+            vectorstore.delete(ids=stale)
+        report.removed_urls += 1
+        report.chunks_deleted += len(stale)
+
+    save_manifest(manifest_path, manifest)
+    report.failed_urls = fetch_report.failed_urls
+    report.total_seconds = time.perf_counter() - started
+    return report
@@ -0,0 +1,278 @@
+"""
+Named, parameterized SQL statements for the Chinook tools.
+
+Every tool query lives in STATEMENTS with :named parameters, so the SQL text of a statement never
+changes between calls. Each pooled sqlite3 connection keeps an LRU cache of prepared statements
+keyed by SQL text (see chinook.STATEMENT_CACHE_SIZE), so after the first call on a connection a
+statement is bound and stepped without being parsed or planned again. Per-statement timings are
+collected in STATEMENT_STATS.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from chinook import get_shared_engine
+from tokens import estimate_tokens
+
+# NOTE: Configure how much of a result a paged tool may put into the conversation. Whichever limit
+# is hit first ends the page; the rest is reachable through the continuation cursor.
+TOOL_MAX_ROWS = int(os.getenv("TOOL_MAX_ROWS", "50"))
+TOOL_MAX_TOKENS = int(os.getenv("TOOL_MAX_TOKENS", "1500"))
+
+STATEMENTS = {
+    # Music catalog. Name filters go through the FTS5 trigram tables (see chinook.SEARCH_TABLES);
+    # CROSS JOIN pins the join order so SQLite starts from the search hits.
+    "albums_by_artist": """
+        SELECT Album.Title, Artist.Name
+        FROM ArtistSearch
+        CROSS JOIN Artist ON Artist.ArtistId = ArtistSearch.rowid
+        CROSS JOIN Album ON Album.ArtistId = Artist.ArtistId
+        WHERE ArtistSearch.Name LIKE :pattern
+    """,
+    "tracks_by_artist": """
+        SELECT Track.Name as SongName, Artist.Name as ArtistName
+        FROM ArtistSearch
+        CROSS JOIN Artist ON Artist.ArtistId = ArtistSearch.rowid
+        CROSS JOIN Album ON Album.ArtistId = Artist.ArtistId
+        LEFT JOIN Track ON Track.AlbumId = Album.AlbumId
+        WHERE ArtistSearch.Name LIKE :pattern
+        ORDER BY Artist.ArtistId, Album.AlbumId, Track.TrackId
+    """,
+    "tracks_by_name": """
+        SELECT Track.* FROM TrackSearch
+        CROSS JOIN Track ON Track.TrackId = TrackSearch.rowid
+        WHERE TrackSearch.Name LIKE :pattern
+        ORDER BY Track.TrackId
+    """,
+    # The same lookups by ID, for names resolved through catalog.TrigramIndex
+    "albums_by_artist_id": """
+        SELECT Album.Title, Artist.Name
+        FROM Artist
+        JOIN Album ON Album.ArtistId = Artist.ArtistId
+        WHERE Artist.ArtistId = :artist_id
+    """,
+    "tracks_by_artist_id": """
+        SELECT Track.Name as SongName, Artist.Name as ArtistName
+        FROM Artist
+        JOIN Album ON Album.ArtistId = Artist.ArtistId
+        LEFT JOIN Track ON Track.AlbumId = Album.AlbumId
+        WHERE Artist.ArtistId = :artist_id
+        ORDER BY Album.AlbumId, Track.TrackId
+    """,
+    "track_by_id": "SELECT Track.* FROM Track WHERE Track.TrackId = :track_id",
+    # Full name lists, for the in-memory indexes in catalog.py
+    "artist_names": "SELECT ArtistId, Name FROM Artist",
+    "album_titles": "SELECT AlbumId, Title FROM Album",
+    "track_names": "SELECT TrackId, Name FROM Track",
+    "genre_tracks": """
+        SELECT Genre.Name, Track.Name, Artist.Name
+        FROM Track
+        JOIN Genre ON Genre.GenreId = Track.GenreId
+        LEFT JOIN Album ON Track.AlbumId = Album.AlbumId
+        LEFT JOIN Artist ON Album.ArtistId = Artist.ArtistId
+        ORDER BY Genre.GenreId, Track.TrackId
+    """,
+    # Invoices, precomputed per customer (see chinook.create_invoice_summary)
+    "invoice_summary_by_customer": """
+        SELECT InvoiceCount, TotalSpent, Invoices, LinesByUnitPrice, SupportRep
+        FROM CustomerInvoiceSummary WHERE CustomerId = :customer_id
+    """,
+    # Identity, loaded whole into catalog.IdentityIndex
+    "customer_identities": "SELECT CustomerId, Email, Phone FROM Customer",
+}
+
+
+@dataclass
+class StatementStats:
+    calls: int = 0
+    rows: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "avg_ms": 1000 * self.total_seconds / self.calls if self.calls else 0.0,
+            "max_ms": 1000 * self.max_seconds,
+            "total_ms": 1000 * self.total_seconds,
+        }
+
+
+# Paged variants skip to an offset in SQL; their text is also fixed, so they are cached the same way
+PAGED_STATEMENTS = {
+    name: f"SELECT * FROM ({sql}) LIMIT -1 OFFSET :page_offset" for name, sql in STATEMENTS.items()
+}
+
+# Only used when a cursor points past the end of a result, to still report its true size
+COUNT_STATEMENTS = {name: f"SELECT COUNT(*) FROM ({sql})" for name, sql in STATEMENTS.items()}
+
+STATEMENT_STATS = {name: StatementStats() for name in STATEMENTS}
+_stats_lock = threading.Lock()
+
+
+def format_cell(value) -> str:
+    if value is None:
+        return ""
+    return str(value).replace("\n", " ").replace("|", "/")
+
+
+def format_table(columns: Sequence[str], rows: Sequence[tuple]) -> str:
+    """
+    Render rows as a compact pipe-separated table with a single header line. This is the one place
+    tool results are serialized for the model: column names appear once instead of once per row
+    (as in a list of dicts), which roughly halves the tokens of a typical result.
+    """
+    lines = [" | ".join(columns)]
+    lines.extend(" | ".join(format_cell(value) for value in row) for row in rows)
+    return "\n".join(lines)
+
+
+@dataclass(slots=True)
+class QueryResult:
+    """Rows exactly as the cursor returned them (plain tuples), plus the column names once."""
+    columns: Tuple[str, ...]
+    rows: List[tuple]
+
+    def __bool__(self):
+        return bool(self.rows)
+
+    @property
+    def total(self) -> int:
+        """Rows in the full result; the same as len(rows), as QueryResult is never paged."""
+        return len(self.rows)
+
+    def scalar(self):
+        """The first column of the first row, or None when there are no rows."""
+        return self.rows[0][0] if self.rows else None
+
+    def to_text(self) -> str:
+        """The text a tool hands back to the model; empty when there are no rows."""
+        return format_table(self.columns, self.rows) if self.rows else ""
+
+
+@dataclass(slots=True)
+class Page:
+    """One budget-limited page of a result, plus what is needed to fetch the next one."""
+    columns: Tuple[str, ...]
+    rows: List[tuple]
+    offset: int
+    total: int
+
+    def __bool__(self):
+        return bool(self.rows)
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        end = self.offset + len(self.rows)
+        return str(end) if end < self.total else None
+
+    def to_text(self) -> str:
+        if not self.rows:
+            return f"[No rows at cursor \"{self.offset}\"; the result has {self.total} rows.]" if self.total else ""
+        text = format_table(self.columns, self.rows)
+        if self.next_cursor is not None:
+            text += (
+                f"\n[Truncated: rows {self.offset + 1}-{self.offset + len(self.rows)} of {self.total}. "
+                f'Call again with cursor="{self.next_cursor}" for more.]'
+            )
+        return text
+
+
+def _record(name: str, rows: int, elapsed: float):
+    with _stats_lock:
+        stats = STATEMENT_STATS[name]
+        stats.calls += 1
+        stats.rows += rows
+        stats.total_seconds += elapsed
+        stats.max_seconds = max(stats.max_seconds, elapsed)
+
+
+def run_statement(name: str, **params) -> QueryResult:
+    """Execute a named statement on a pooled connection and record how long it took."""
+    sql = STATEMENTS[name]
+    # Pool waits are tracked by the pool itself (chinook.get_engine_metrics), so time only the query
+    connection = get_shared_engine().raw_connection()
+    started = time.perf_counter()
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            columns = tuple(column[0] for column in cursor.description or ())
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        elapsed = time.perf_counter() - started
+    finally:
+        connection.close()  # Returns the connection to the pool
+
+    _record(name, len(rows), elapsed)
+    return QueryResult(columns, rows)
+
+
+def parse_cursor(cursor: Optional[str]) -> int:
+    try:
+        return max(0, int(cursor))
+    except (TypeError, ValueError):
+        return 0
+
+
+def run_statement_paged(
+    name: str,
+    cursor: Optional[str] = None,
+    max_rows: int = TOOL_MAX_ROWS,
+    max_tokens: int = TOOL_MAX_TOKENS,
+    **params,
+) -> Page:
+    """
+    Execute a named statement starting at the row given by cursor, and stream rows off the cursor
+    until max_rows or max_tokens (of formatted output) is reached. The remaining rows are only
+    counted, never formatted, so the page stays small however large the full result is.
+    """
+    offset = parse_cursor(cursor)
+    connection = get_shared_engine().raw_connection()
+    started = time.perf_counter()
+    try:
+        db_cursor = connection.cursor()
+        try:
+            db_cursor.execute(PAGED_STATEMENTS[name], {**params, "page_offset": offset})
+            columns = tuple(column[0] for column in db_cursor.description or ())
+            page = take_page(columns, db_cursor, offset, max_rows, max_tokens)
+            if not page.rows and offset:
+                page.total = db_cursor.execute(COUNT_STATEMENTS[name], params).fetchone()[0]
+        finally:
+            db_cursor.close()
+        elapsed = time.perf_counter() - started
+    finally:
+        connection.close()
+
+    _record(name, len(page.rows), elapsed)
+    return page
+
+
+def take_page(
+    columns: Tuple[str, ...], rows: Iterable[tuple], offset: int = 0,
+    max_rows: int = TOOL_MAX_ROWS, max_tokens: int = TOOL_MAX_TOKENS,
+) -> Page:
+    """Take rows (already positioned at offset) until a budget is hit, and count the rest."""
+    rows = iter(rows)
+    taken = []
+    tokens = estimate_tokens(" | ".join(columns))
+    remaining = 0
+    for row in rows:
+        tokens += estimate_tokens(" | ".join(format_cell(value) for value in row))
+        if taken and (len(taken) >= max_rows or tokens > max_tokens):
+            # This row doesn't fit; count it and everything after it
+            remaining = 1 + sum(1 for _ in rows)
+            break
+        taken.append(row)
+    return Page(columns, taken, offset, offset + len(taken) + remaining)
+
+
+def get_statement_stats() -> dict:
+    """Per-statement call counts and timings, slowest total time first."""
+    with _stats_lock:
+        stats = {name: s.as_dict() for name, s in STATEMENT_STATS.items() if s.calls}
+    return dict(sorted(stats.items(), key=lambda item: item[1]["total_ms"], reverse=True))
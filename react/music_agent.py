@@ -1,14 +1,17 @@
+from startup import ImportTimer
+_import_timer = ImportTimer(__name__)
+
 from typing_extensions import TypedDict
 from typing import Annotated, Optional
 
-from langchain_community.utilities.sql_database import SQLDatabase
 from langgraph.graph.message import AnyMessage, add_messages
 from langgraph.managed.is_last_step import RemainingSteps
 
-from utils import llm, get_engine_for_chinook_db
-
-engine = get_engine_for_chinook_db()
-db = SQLDatabase(engine)
+from caching import cached, coalesced
+from catalog import CATALOG_SOURCES, fuzzy_search, get_genre_summary, resolve_name
+from startup import lazy_resource
+from queries import format_table, run_statement, run_statement_paged
+from utils import llm
 
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
@@ -18,36 +21,54 @@ class State(TypedDict):
 
 
 from langchain_core.tools import tool
-import ast
+
+def with_fuzzy_fallback(kind: str, name: str, search, search_by_id):
+    """
+    Run search(pattern) for the name as given. If the name matches no rows at all, resolve it to the
+    closest catalog name of this kind and run search_by_id(id) for that instead, saying so in the result.
+    """
+    result = search(f"%{name}%")
+    # total counts every matching row, so a cursor past the last page doesn't count as no match
+    if result.total:
+        return result.to_text()
+    match = resolve_name(kind, name)
+    if match is None:
+        return result.to_text()
+    note = f"No {kind} matches '{name}'; showing the closest {kind}, '{match.name}' (similarity {match.similarity:.2f})."
+    return f"{note}\n{search_by_id(match.id).to_text() or 'No results for it either.'}"
 
 @tool
+@cached
+@coalesced
 def get_albums_by_artist(artist: str):
-    """Get albums by an artist."""
-    return db.run(
-        f"""
-        SELECT Album.Title, Artist.Name 
-        FROM Album 
-        JOIN Artist ON Album.ArtistId = Artist.ArtistId 
-        WHERE Artist.Name LIKE '%{artist}%';
-        """,
-        include_columns=True
+    """Get albums by an artist. Misspelled or partial names fall back to the closest artist."""
+    return with_fuzzy_fallback(
+        "artist",
+        artist,
+        lambda pattern: run_statement("albums_by_artist", pattern=pattern),
+        lambda artist_id: run_statement("albums_by_artist_id", artist_id=artist_id),
     )
 
 @tool
-def get_tracks_by_artist(artist: str):
-    """Get songs by an artist (or similar artists)."""
-    return db.run(
-        f"""
-        SELECT Track.Name as SongName, Artist.Name as ArtistName 
-        FROM Album 
-        LEFT JOIN Artist ON Album.ArtistId = Artist.ArtistId 
-        LEFT JOIN Track ON Track.AlbumId = Album.AlbumId 
-        WHERE Artist.Name LIKE '%{artist}%';
-        """,
-        include_columns=True
+@cached
+@coalesced
+def get_tracks_by_artist(artist: str, cursor: Optional[str] = None):
+    """
+    Get songs by an artist (or similar artists). Misspelled or partial names fall back to the closest artist.
+
+    Long results are returned one page at a time. If the result ends with a truncation note, call
+    again with the cursor it gives to get the next page.
+    """
+    return with_fuzzy_fallback(
+        "artist",
+        artist,
+        lambda pattern: run_statement_paged("tracks_by_artist", cursor=cursor, pattern=pattern),
+        lambda artist_id: run_statement_paged("tracks_by_artist_id", cursor=cursor, artist_id=artist_id),
     )
 
 @tool
+@cached
+@coalesced
 def get_songs_by_genre(genre: str):
     """
     Fetch songs from the database that match a specific genre.
@@ -56,45 +77,57 @@ def get_songs_by_genre(genre: str):
         genre (str): The genre of the songs to fetch.
     
     Returns:
-        list[dict]: A list of songs that match the specified genre.
-    """
-    genre_id_query = f"SELECT GenreId FROM Genre WHERE Name LIKE '%{genre}%'"
-    genre_ids = db.run(genre_id_query)
-    if not genre_ids:
-        return f"No songs found for the genre: {genre}"
-    genre_ids = ast.literal_eval(genre_ids)
-    genre_id_list = ", ".join(str(gid[0]) for gid in genre_ids)
-
-    songs_query = f"""
-        SELECT Track.Name as SongName, Artist.Name as ArtistName
-        FROM Track
-        LEFT JOIN Album ON Track.AlbumId = Album.AlbumId
-        LEFT JOIN Artist ON Album.ArtistId = Artist.ArtistId
-        WHERE Track.GenreId IN ({genre_id_list})
-        GROUP BY Artist.Name
-        LIMIT 8;
+        str: A table of songs (and their artists) that match the specified genre.
     """
-    songs = db.run(songs_query, include_columns=True)
+    songs = get_genre_summary().lookup(genre)
     if not songs:
         return f"No songs found for the genre: {genre}"
-    formatted_songs = ast.literal_eval(songs)
-    return [
-        {"Song": song["SongName"], "Artist": song["ArtistName"]}
-        for song in formatted_songs
-    ]
+    return format_table(("Song", "Artist"), songs)
+
+@tool
+@cached
+@coalesced
+def check_for_songs(song_title, cursor: Optional[str] = None):
+    """
+    Check if a song exists by its name. Misspelled or partial titles fall back to the closest song.
+
+    Long results are returned one page at a time. If the result ends with a truncation note, call
+    again with the cursor it gives to get the next page.
+    """
+    return with_fuzzy_fallback(
+        "track",
+        song_title,
+        lambda pattern: run_statement_paged("tracks_by_name", cursor=cursor, pattern=pattern),
+        lambda track_id: run_statement_paged("track_by_id", cursor=cursor, track_id=track_id),
+    )
 
 @tool
-def check_for_songs(song_title):
-    """Check if a song exists by its name."""
-    return db.run(
-        f"""
-        SELECT * FROM Track WHERE Name LIKE '%{song_title}%';
-        """,
-        include_columns=True
+@cached
+@coalesced
+def search_catalog_names(name: str, kind: Optional[str] = None):
+    """
+    Find the catalog names closest to a possibly misspelled or partial name, with similarity scores (0-1).
+
+    Args:
+        name (str): The name to look up.
+        kind (str, optional): "artist", "album" or "track". Searches all three when omitted.
+
+    Returns:
+        str: A table of the closest names with their kind, ID and similarity, best first.
+    """
+    kinds = [kind] if kind in CATALOG_SOURCES else list(CATALOG_SOURCES)
+    matches = fuzzy_search(name, kinds)
+    if not matches:
+        return f"No catalog names resemble: {name}"
+    return format_table(
+        ("Kind", "Id", "Name", "Similarity"), [(m.kind, m.id, m.name, f"{m.similarity:.2f}") for m in matches]
     )
 
-music_tools = [get_albums_by_artist, get_tracks_by_artist, get_songs_by_genre, check_for_songs]
-llm_with_music_tools = llm.bind_tools(music_tools)
+music_tools = [get_albums_by_artist, get_tracks_by_artist, get_songs_by_genre, check_for_songs, search_catalog_names]
+
+@lazy_resource
+def get_llm_with_music_tools():
+    return llm.bind_tools(music_tools)
 
 from langgraph.prebuilt import ToolNode
 # Node
@@ -127,12 +160,11 @@ def music_assistant(state: State, config: RunnableConfig):
     
     SEARCH GUIDELINES:
     1. Always perform thorough searches before concluding something is unavailable
-    2. If exact matches aren't found, try:
-       - Checking for alternative spellings
-       - Looking for similar artist names
-       - Searching by partial matches
-       - Checking different versions/remixes
-    3. When providing song lists:
+    2. The tools already fall back to the closest artist or song name when nothing matches exactly, and say so in
+       their result; don't retry alternative spellings yourself. If you're unsure which artist, album or song the
+       customer means, call search_catalog_names once to see the closest names and their similarity scores.
+    3. Check for different versions/remixes when relevant
+    4. When providing song lists:
        - Include the artist name with each song
        - Mention the album when relevant
        - Note if it's part of any playlists
@@ -146,7 +178,7 @@ def music_assistant(state: State, config: RunnableConfig):
     """
 
     # Invoke the model
-    response = llm_with_music_tools.invoke([SystemMessage(music_assistant_prompt)] + state["messages"])
+    response = get_llm_with_music_tools().invoke([SystemMessage(music_assistant_prompt)] + state["messages"])
     
     # Update the state
     return {"messages": [response]}
@@ -194,4 +226,6 @@ music_workflow.add_conditional_edges(
 
 music_workflow.add_edge("music_tool_node", "music_assistant")
 
-graph = music_workflow.compile(name="music_catalog_subagent")
\ No newline at end of file
+graph = music_workflow.compile(name="music_catalog_subagent")
+
+_import_timer.stop()
@@ -1,4 +1,9 @@
-from utils import llm, get_engine_for_chinook_db
+from startup import ImportTimer
+_import_timer = ImportTimer(__name__)
+
+from startup import lazy_resource
+from utils import llm
+from react.music_agent import music_tools
 from react.utils import (
     all_real_tools, 
     all_fake_tools,
@@ -7,15 +12,11 @@ from react.utils import (
     HR_INSTRUCTIONS, 
     LEAD_MANAGEMENT_INSTRUCTIONS
 )
-from langchain_community.utilities.sql_database import SQLDatabase
 from typing_extensions import TypedDict
 from typing import Annotated, Optional
 from langgraph.graph.message import AnyMessage, add_messages
 from langgraph.managed.is_last_step import RemainingSteps
 
-engine = get_engine_for_chinook_db()
-db = SQLDatabase(engine)
-
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     customer_id: Optional[str]
@@ -23,87 +24,13 @@ class State(TypedDict):
     remaining_steps: Optional[RemainingSteps]
 
 
-from langchain_core.tools import tool
-import ast
-
-@tool
-def get_albums_by_artist(artist: str):
-    """Get albums by an artist."""
-    return db.run(
-        f"""
-        SELECT Album.Title, Artist.Name 
-        FROM Album 
-        JOIN Artist ON Album.ArtistId = Artist.ArtistId 
-        WHERE Artist.Name LIKE '%{artist}%';
-        """,
-        include_columns=True
-    )
-
-@tool
-def get_tracks_by_artist(artist: str):
-    """Get songs by an artist (or similar artists)."""
-    return db.run(
-        f"""
-        SELECT Track.Name as SongName, Artist.Name as ArtistName 
-        FROM Album 
-        LEFT JOIN Artist ON Album.ArtistId = Artist.ArtistId 
-        LEFT JOIN Track ON Track.AlbumId = Album.AlbumId 
-        WHERE Artist.Name LIKE '%{artist}%';
-        """,
-        include_columns=True
-    )
-
-@tool
-def get_songs_by_genre(genre: str):
-    """
-    Fetch songs from the database that match a specific genre.
-    
-    Args:
-        genre (str): The genre of the songs to fetch.
-    
-    Returns:
-        list[dict]: A list of songs that match the specified genre.
-    """
-    genre_id_query = f"SELECT GenreId FROM Genre WHERE Name LIKE '%{genre}%'"
-    genre_ids = db.run(genre_id_query)
-    if not genre_ids:
-        return f"No songs found for the genre: {genre}"
-    genre_ids = ast.literal_eval(genre_ids)
-    genre_id_list = ", ".join(str(gid[0]) for gid in genre_ids)
-
-    songs_query = f"""
-        SELECT Track.Name as SongName, Artist.Name as ArtistName
-        FROM Track
-        LEFT JOIN Album ON Track.AlbumId = Album.AlbumId
-        LEFT JOIN Artist ON Album.ArtistId = Artist.ArtistId
-        WHERE Track.GenreId IN ({genre_id_list})
-        GROUP BY Artist.Name
-        LIMIT 8;
-    """
-    songs = db.run(songs_query, include_columns=True)
-    if not songs:
-        return f"No songs found for the genre: {genre}"
-    formatted_songs = ast.literal_eval(songs)
-    return [
-        {"Song": song["SongName"], "Artist": song["ArtistName"]}
-        for song in formatted_songs
-    ]
-
-@tool
-def check_for_songs(song_title):
-    """Check if a song exists by its name."""
-    return db.run(
-        f"""
-        SELECT * FROM Track WHERE Name LIKE '%{song_title}%';
-        """,
-        include_columns=True
-    )
-
 from langgraph.prebuilt import ToolNode
 
-music_tools = [get_albums_by_artist, get_tracks_by_artist, get_songs_by_genre, check_for_songs]
 tool_node = ToolNode(music_tools + all_real_tools + all_fake_tools) # Node
-llm_with_tools = llm.bind_tools(music_tools + all_real_tools + all_fake_tools)
+
+@lazy_resource
+def get_llm_with_tools():
+    return llm.bind_tools(music_tools + all_real_tools + all_fake_tools)
 
 from langchain_core.messages import ToolMessage, SystemMessage, HumanMessage
 from langchain_core.runnables import RunnableConfig
@@ -171,7 +98,7 @@ def assistant(state: State, config: RunnableConfig):
     """
 
     # Invoke the model
-    response = llm_with_tools.invoke([SystemMessage(assistant_prompt)] + state["messages"])
+    response = get_llm_with_tools().invoke([SystemMessage(assistant_prompt)] + state["messages"])
     
     # Update the state
     return {"messages": [response]}
@@ -219,4 +146,6 @@ workflow.add_conditional_edges(
 
 workflow.add_edge("tool_node", "assistant")
 
-graph = workflow.compile(name="noisy_agent")
\ No newline at end of file
+graph = workflow.compile(name="noisy_agent")
+
+_import_timer.stop()
@@ -0,0 +1,444 @@
+import hashlib
+import json
+import os
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from embeddings import TOKEN_PATTERN
+
+
+# Written last when an index directory is exported, so a partial export never matches its source
+FINGERPRINT_FILE = "fingerprint"
+
+
+def fingerprint_ids(ids: Sequence[str]) -> str:
+    """A hash of a store's sorted chunk IDs. Chunks are only ever added or deleted, never edited in place."""
+    return hashlib.sha256("\0".join(sorted(ids)).encode("utf-8")).hexdigest()
+
+
+def chroma_fingerprint(vectorstore) -> str:
+    return fingerprint_ids(vectorstore.get(include=[])["ids"])
+
+
+def read_fingerprint(directory: str) -> Optional[str]:
+    """The fingerprint of the store an index directory was exported from, or None if the export is missing or incomplete."""
+    try:
+        with open(os.path.join(directory, FINGERPRINT_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def clear_fingerprint(directory: str):
+    if os.path.exists(os.path.join(directory, FINGERPRINT_FILE)):
+        os.remove(os.path.join(directory, FINGERPRINT_FILE))
+
+
+def write_fingerprint(directory: str, fingerprint: str):
+    with open(os.path.join(directory, FINGERPRINT_FILE), "w") as f:
+        f.write(fingerprint)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without sorting the whole array."""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class NumpyVectorIndex:
+    """
+    A flat, in-process vector index: a float32 (or int8-quantized) matrix of normalized
+    embeddings, memory-mapped from disk, plus a JSON sidecar with the chunk text and metadata.
+
+    Loading maps the matrix instead of reading it, so startup costs next to nothing, and a
+    query is a single matrix-vector product followed by a partial sort.
+
+    Layout of the index directory:
+        vectors.npy     float32 [n, dim], or int8 [n, dim] when quantized
+        scales.npy      float32 [n], per-row dequantization scales (quantized only)
+        documents.json  {"model": ..., "quantized": ..., "documents": [{id, page_content, metadata}]}
+        fingerprint     chroma_fingerprint of the source store, when exported from one
+    """
+
+    # Rows dequantized per step in int8 mode, bounding the temporary float32 copy
+    BLOCK_SIZE = 8192
+
+    def __init__(self, vectors: np.ndarray, documents: List[dict], scales: np.ndarray = None, model: str = None):
+        self.vectors = vectors
+        self.documents = documents
+        self.scales = scales
+        self.model = model
+
+    @property
+    def quantized(self) -> bool:
+        return self.scales is not None
+
+    def __len__(self):
+        return len(self.documents)
+
+    @classmethod
+    def write(
+        cls,
+        directory: str,
+        vectors: np.ndarray,
+        documents: Sequence[Tuple[str, str, dict]],
+        model: str = None,
+        quantize: bool = False,
+        fingerprint: str = None,
+    ):
+        """Persist (id, page_content, metadata) triples and their embeddings as an index directory."""
+        os.makedirs(directory, exist_ok=True)
+        clear_fingerprint(directory)
+        vectors = normalize_rows(vectors)
+        if quantize:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+            np.save(os.path.join(directory, "vectors.npy"), quantized)
+            np.save(os.path.join(directory, "scales.npy"), scales.astype(np.float32))
+        else:
+            np.save(os.path.join(directory, "vectors.npy"), vectors)
+            if os.path.exists(os.path.join(directory, "scales.npy")):
+                os.remove(os.path.join(directory, "scales.npy"))
+        sidecar = {
+            "model": model,
+            "quantized": quantize,
+            "documents": [
+                {"id": doc_id, "page_content": text, "metadata": metadata or {}}
+                for doc_id, text, metadata in documents
+            ],
+        }
+        with open(os.path.join(directory, "documents.json"), "w") as f:
+            json.dump(sidecar, f)
+        if fingerprint is not None:
+            write_fingerprint(directory, fingerprint)
+
+    @classmethod
+    def load(cls, directory: str) -> "NumpyVectorIndex":
+        with open(os.path.join(directory, "documents.json")) as f:
+            sidecar = json.load(f)
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        scales = None
+        if sidecar["quantized"]:
+            scales = np.load(os.path.join(directory, "scales.npy"))
+        return cls(vectors, sidecar["documents"], scales=scales, model=sidecar.get("model"))
+
+    def scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query against every row."""
+        query = normalize_rows(query_vector)
+        if not self.quantized:
+            return self.vectors @ query
+        scores = np.empty(len(self.vectors), dtype=np.float32)
+        for start in range(0, len(self.vectors), self.BLOCK_SIZE):
+            block = self.vectors[start:start + self.BLOCK_SIZE].astype(np.float32)
+            scores[start:start + self.BLOCK_SIZE] = block @ query
+        return scores * self.scales
+
+    def document(self, i: int, similarity: float = None) -> Document:
+        record = self.documents[i]
+        metadata = dict(record["metadata"])
+        if similarity is not None:
+            metadata["similarity"] = similarity
+        return Document(id=record["id"], page_content=record["page_content"], metadata=metadata)
+
+    def search(self, query_vector: np.ndarray, k: int = 4) -> List[Document]:
+        scores = self.scores(query_vector)
+        return [self.document(i, float(scores[i])) for i in top_k(scores, k)]
+
+
+class NumpyIndexRetriever(BaseRetriever):
+    """LangChain retriever over a NumpyVectorIndex, so it can stand in for vectorstore.as_retriever()."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: NumpyVectorIndex
+    embeddings: Embeddings
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        return self.index.search(query_vector, self.k)
+
+
+def mmr_select(query_vector: np.ndarray, candidate_vectors: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """
+    Maximal marginal relevance: pick k candidates balancing similarity to the query (lambda_mult=1)
+    against similarity to what was already picked (lambda_mult=0).
+
+    The candidate-candidate similarities are one matrix product up front, and each pick updates
+    every candidate's max-similarity-to-selected with a single vectorized np.maximum, so the only
+    Python loop is over the k picks.
+    """
+    if len(candidate_vectors) == 0:
+        return []
+    candidates = normalize_rows(candidate_vectors)
+    relevance = candidates @ normalize_rows(query_vector)
+    similarity = candidates @ candidates.T
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    max_similarity = similarity[first].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[first] = False
+    while len(selected) < min(k, len(candidates)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+def chroma_candidates(vectorstore):
+    """Candidate source for MMRRetriever that over-fetches from a Chroma store, embeddings included."""
+    def fetch(query_vector: np.ndarray, fetch_k: int):
+        results = vectorstore._collection.query(
+            query_embeddings=[query_vector.tolist()],
+            n_results=fetch_k,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        documents = [
+            Document(id=doc_id, page_content=text, metadata=metadata or {})
+            for doc_id, text, metadata in zip(results["ids"][0], results["documents"][0], results["metadatas"][0])
+        ]
+        return documents, np.asarray(results["embeddings"][0], dtype=np.float32)
+    return fetch
+
+
+def numpy_index_candidates(index: NumpyVectorIndex):
+    """Candidate source for MMRRetriever backed by a NumpyVectorIndex."""
+    def fetch(query_vector: np.ndarray, fetch_k: int):
+        rows = top_k(index.scores(query_vector), fetch_k)
+        vectors = np.asarray(index.vectors[rows], dtype=np.float32)
+        if index.quantized:
+            vectors *= index.scales[rows][:, None]
+        return [index.document(i) for i in rows], vectors
+    return fetch
+
+
+class MMRRetriever(BaseRetriever):
+    """
+    Over-fetches fetch_k candidates by similarity, then re-ranks them with MMR down to k, so
+    near-duplicate chunks don't crowd out the rest of the top-k.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    embeddings: Embeddings
+    # Callable (query_vector, fetch_k) -> (documents, candidate vectors)
+    fetch_candidates: Callable
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        documents, vectors = self.fetch_candidates(query_vector, max(self.fetch_k, self.k))
+        if not documents:
+            return []
+        selected = mmr_select(query_vector, vectors, self.k, self.lambda_mult)
+        similarities = normalize_rows(vectors[selected]) @ normalize_rows(query_vector)
+        results = []
+        for i, similarity in zip(selected, similarities):
+            doc = documents[i]
+            results.append(Document(id=doc.id, page_content=doc.page_content, metadata={**doc.metadata, "similarity": float(similarity)}))
+        return results
+
+
+def export_chroma_to_numpy_index(vectorstore, directory: str, model: str = None, quantize: bool = False):
+    """Copy the chunks and stored embeddings out of a Chroma collection, without re-embedding."""
+    data = vectorstore.get(include=["embeddings", "documents", "metadatas"])
+    documents = list(zip(data["ids"], data["documents"], data["metadatas"]))
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    NumpyVectorIndex.write(directory, vectors, documents, model=model, quantize=quantize, fingerprint=fingerprint_ids(data["ids"]))
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; identifiers like MemorySaver or add_messages stay whole."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    A persisted sparse inverted index scored with Okapi BM25.
+
+    Postings are stored CSR-style: the postings of term t are doc_ids/term_freqs in
+    [offsets[t], offsets[t + 1]). Scoring a query touches only the postings of its terms and
+    accumulates them into a dense score array with NumPy.
+
+    Layout of the index directory:
+        postings.npz    offsets, doc_ids, term_freqs, doc_lengths
+        vocabulary.json term -> term id
+        documents.json  [{id, page_content, metadata}]
+        fingerprint     chroma_fingerprint of the source store, when built from one
+    """
+
+    def __init__(self, vocabulary: dict, offsets, doc_ids, term_freqs, doc_lengths, documents, k1=1.5, b=0.75):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        n = len(documents)
+        doc_freqs = np.diff(offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (n - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        average_length = doc_lengths.mean() if n else 1.0
+        # Per-document part of the BM25 denominator, computed once
+        self.length_norm = (k1 * (1 - b + b * doc_lengths / average_length)).astype(np.float32)
+
+    @classmethod
+    def build(cls, documents: Sequence[Tuple[str, str, dict]], **kwargs) -> "BM25Index":
+        vocabulary = {}
+        postings = {}  # term id -> {doc index: term frequency}
+        doc_lengths = np.zeros(len(documents), dtype=np.float32)
+        for i, (_, text, _) in enumerate(documents):
+            tokens = tokenize(text)
+            doc_lengths[i] = len(tokens)
+            for token in tokens:
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                counts = postings.setdefault(term_id, {})
+                counts[i] = counts.get(i, 0) + 1
+
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        doc_ids, term_freqs = [], []
+        for term_id in range(len(vocabulary)):
+            counts = postings[term_id]
+            offsets[term_id + 1] = offsets[term_id] + len(counts)
+            doc_ids.extend(counts.keys())
+            term_freqs.extend(counts.values())
+        records = [
+            {"id": doc_id, "page_content": text, "metadata": metadata or {}}
+            for doc_id, text, metadata in documents
+        ]
+        return cls(
+            vocabulary,
+            offsets,
+            np.asarray(doc_ids, dtype=np.int32),
+            np.asarray(term_freqs, dtype=np.float32),
+            doc_lengths,
+            records,
+            **kwargs,
+        )
+
+    def save(self, directory: str, fingerprint: str = None):
+        os.makedirs(directory, exist_ok=True)
+        clear_fingerprint(directory)
+        np.savez(
+            os.path.join(directory, "postings.npz"),
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            term_freqs=self.term_freqs,
+            doc_lengths=self.doc_lengths,
+        )
+        with open(os.path.join(directory, "vocabulary.json"), "w") as f:
+            json.dump(self.vocabulary, f)
+        with open(os.path.join(directory, "documents.json"), "w") as f:
+            json.dump(self.documents, f)
+        if fingerprint is not None:
+            write_fingerprint(directory, fingerprint)
+
+    @classmethod
+    def load(cls, directory: str, **kwargs) -> "BM25Index":
+        arrays = np.load(os.path.join(directory, "postings.npz"))
+        with open(os.path.join(directory, "vocabulary.json")) as f:
+            vocabulary = json.load(f)
+        with open(os.path.join(directory, "documents.json")) as f:
+            documents = json.load(f)
+        return cls(
+            vocabulary,
+            arrays["offsets"],
+            arrays["doc_ids"],
+            arrays["term_freqs"],
+            arrays["doc_lengths"],
+            documents,
+            **kwargs,
+        )
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+        return scores
+
+    def search(self, query: str, k: int = 4) -> List[Document]:
+        scores = self.scores(query)
+        results = []
+        for i in top_k(scores, k):
+            if scores[i] <= 0:
+                break
+            record = self.documents[i]
+            results.append(Document(id=record["id"], page_content=record["page_content"], metadata=dict(record["metadata"])))
+        return results
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """Fuse ranked lists by summing 1 / (rrf_k + rank); documents are matched on id, then on text."""
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Combines a dense retriever with BM25 keyword search using reciprocal rank fusion, so short,
+    keyword-heavy questions (e.g. "interrupt", "MemorySaver") still surface the chunks that
+    mention them verbatim. The dense retriever should return fetch_k candidates like the BM25 side,
+    so both rankings carry equal weight; fusion then cuts the result to k.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    dense_retriever: BaseRetriever
+    bm25_index: BM25Index
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        dense = self.dense_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        sparse = self.bm25_index.search(query, self.fetch_k)
+        return reciprocal_rank_fusion([dense, sparse], k=self.k, rrf_k=self.rrf_k)
+
+
+def build_bm25_index_from_chroma(vectorstore, directory: str) -> BM25Index:
+    data = vectorstore.get(include=["documents", "metadatas"])
+    index = BM25Index.build(list(zip(data["ids"], data["documents"], data["metadatas"])))
+    index.save(directory, fingerprint=fingerprint_ids(data["ids"]))
+    return index
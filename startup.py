@@ -0,0 +1,92 @@
+"""
+Lazy, memoized resource initializers and a report of where startup time goes.
+
+Run `python startup.py` to import every graph registered in langgraph.json and print how long
+each module's import took. Resources built later on first use show up in the report as well.
+"""
+import functools
+import threading
+import time
+
+_timings = []  # (kind, name, seconds), in the order they were recorded
+_timings_lock = threading.Lock()
+
+
+def record_timing(kind: str, name: str, seconds: float):
+    with _timings_lock:
+        _timings.append((kind, name, seconds))
+
+
+class ImportTimer:
+    """Create at the top of a module and stop() at the bottom to record its import time."""
+
+    def __init__(self, module_name: str):
+        self.module_name = module_name
+        self.started = time.perf_counter()
+
+    def stop(self):
+        record_timing("import", self.module_name, time.perf_counter() - self.started)
+
+
+def lazy_resource(fn):
+    """
+    Turn an initializer into a thread-safe, memoized one that runs on first use.
+
+    Results are memoized per argument tuple. Concurrent first callers block on a per-key lock, so
+    the resource is built exactly once; later calls are a dict lookup. The build time is recorded
+    in the startup report. Call .reset() on the wrapper to drop memoized results (e.g. after the
+    underlying data changed).
+    """
+    results = {}
+    locks = {}
+    locks_lock = threading.Lock()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            return results[key]
+        except KeyError:
+            pass
+        with locks_lock:
+            lock = locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in results:
+                started = time.perf_counter()
+                results[key] = fn(*args, **kwargs)
+                elapsed = time.perf_counter() - started
+                record_timing("init", fn.__qualname__, elapsed)
+                print(f"Initialized {fn.__qualname__} in {elapsed:.2f}s")
+            return results[key]
+
+    def reset():
+        with locks_lock:
+            results.clear()
+
+    wrapper.reset = reset
+    return wrapper
+
+
+def startup_report() -> str:
+    with _timings_lock:
+        timings = list(_timings)
+    if not timings:
+        return "No startup timings recorded"
+    width = max(len(name) for _, name, _ in timings)
+    lines = [f"{kind:<6} {name:<{width}} {seconds * 1000:>10.1f} ms" for kind, name, seconds in timings]
+    return "\n".join(["Startup report:"] + lines)
+
+
+if __name__ == "__main__":
+    import importlib
+    import json
+
+    # Graph modules import this file as `startup`, not `__main__`, so report from that copy
+    from startup import startup_report
+
+    with open("langgraph.json") as f:
+        graphs = json.load(f)["graphs"]
+    for path in graphs.values():
+        module_name = path.split(":")[0].removeprefix("./").removesuffix(".py").replace("/", ".")
+        importlib.import_module(module_name)
+    print(startup_report())
@@ -0,0 +1,6 @@
+"""Dependency-free helpers for budgeting prompt and tool output sizes."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text), for budgeting prompt sizes."""
+    return len(text) // 4 + 1
@@ -1,17 +1,122 @@
+from startup import ImportTimer, lazy_resource
+_import_timer = ImportTimer(__name__)
+
 import os
+import re
+import shutil
+from typing import Callable, Optional, Tuple
+
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import WebBaseLoader
+from chromadb.api.client import SharedSystemClient
 from langchain_chroma import Chroma
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_core.messages import AIMessage, message_chunk_to_message
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from langgraph.config import get_stream_writer
+from embeddings import CachedEmbeddings, HashingEmbeddings, get_model_name
+from ingestion import ingest_documents, sync_documents, web_loader
+from retrievers import (
+    BM25Index,
+    HybridRetriever,
+    MMRRetriever,
+    NumpyIndexRetriever,
+    NumpyVectorIndex,
+    build_bm25_index_from_chroma,
+    chroma_candidates,
+    chroma_fingerprint,
+    export_chroma_to_numpy_index,
+    numpy_index_candidates,
+    read_fingerprint,
+)
 
 # NOTE: Configure the LLM that you want to use
 llm = ChatOpenAI(model_name="gpt-4o", temperature=0)
 # llm = ChatAnthropic(model_name="claude-3-5-sonnet-20240620", temperature=0)
 # llm = ChatVertexAI(model_name="gemini-1.5-flash-002", temperature=0)
 
+# NOTE: Configure whether the search graph checks grounding while the answer streams, each time a sentence
+# completes (results go to stream_mode="custom"). Tokens reach stream_mode="messages" either way.
+STREAM_GENERATION = os.getenv("STREAM_GENERATION", "false").lower() == "true"
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def get_graph_stream_writer():
+    """The current graph run's "custom" stream writer, or a no-op when called outside a graph."""
+    try:
+        return get_stream_writer()
+    except (RuntimeError, KeyError):
+        return lambda _: None
+
+def stream_answer(messages, check_prefix: Callable[[str], bool]) -> Tuple[AIMessage, Optional[bool]]:
+    """
+    Generate with llm.stream, checking the answer so far on a background thread while tokens keep arriving.
+    Each check covers everything up to the last complete sentence, so a sentence is judged in the context of
+    the ones before it. One check runs at a time and the next covers every sentence completed meanwhile, then
+    the whole answer is checked last. Each result goes to the "custom" stream as soon as it is known, and the
+    first failure stops generation early. Returns the (possibly partial) answer, and True/False for whether it
+    passed, or None for an empty answer.
+    """
+    writer = get_graph_stream_writer()
+    executor = ContextThreadPoolExecutor(max_workers=1)
+    in_flight = None  # (prefix, future)
+    checked = ""  # The longest prefix sent for checking
+    grounded = None
+
+    def submit(prefix: str):
+        nonlocal in_flight, checked
+        in_flight, checked = (prefix, executor.submit(check_prefix, prefix)), prefix
+
+    def land() -> bool:
+        nonlocal in_flight, grounded
+        prefix, future = in_flight
+        in_flight = None
+        grounded = future.result()
+        writer({"grounding": {"answer": prefix, "grounded": grounded}})
+        return grounded
+
+    chunks = None
+    text = ""
+    try:
+        for chunk in llm.stream(messages):
+            chunks = chunk if chunks is None else chunks + chunk
+            text += chunk.content if isinstance(chunk.content, str) else ""
+            if in_flight is not None and in_flight[1].done() and not land():
+                break
+            if in_flight is None:
+                end = len(checked)
+                for match in SENTENCE_END.finditer(text, len(checked)):
+                    end = match.start()
+                if end > len(checked):
+                    submit(text[:end])
+        if grounded is not False and in_flight is not None:
+            land()
+        if grounded is not False and text.strip() and text.rstrip() != checked:
+            submit(text.rstrip())
+            land()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Keeps the id, response_metadata and usage_metadata gathered from the chunks
+    answer = message_chunk_to_message(chunks) if chunks is not None else AIMessage(content="")
+    if grounded is False:
+        print(f"---STREAM STOPPED: UNGROUNDED ANSWER: ...{checked[-80:]}---")
+    return answer, grounded
+
 
 # NOTE: Configure the embedding model that you want to use
-embedding_model = OpenAIEmbeddings()
+# - "openai": OpenAIEmbeddings, with document vectors cached on disk by content hash so rebuilding
+#   the index only embeds new chunks
+# - "hashing": a local, deterministic hashing embedder; no network, microsecond query embeddings
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+EMBEDDING_CACHE_PATH = "embedding-cache.sqlite"
+
+@lazy_resource
+def get_embedding_model(backend: str = EMBEDDING_BACKEND):
+    if backend == "openai":
+        return CachedEmbeddings(OpenAIEmbeddings(), cache_path=EMBEDDING_CACHE_PATH)
+    if backend == "hashing":
+        return HashingEmbeddings()
+    raise ValueError(f"Unknown embedding backend: {backend}")
 
 LANGGRAPH_DOCS = [
     "https://langchain-ai.github.io/langgraph/",
@@ -34,50 +139,158 @@ LANGGRAPH_DOCS = [
     "https://langchain-ai.github.io/langgraph/concepts/faq/"
 ]
 
-def get_langgraph_docs_retriever():
+# NOTE: Configure how the docs index is built. Pages are fetched by a bounded pool of workers and
+# chunks are embedded in fixed-size batches. Swap DOCS_LOADER for make_local_file_loader(<dir>)
+# to build the index offline from a local snapshot of the docs.
+INGESTION_MAX_WORKERS = 8
+EMBEDDING_BATCH_SIZE = 64
+DOCS_LOADER = web_loader
+
+# NOTE: Configure how the docs index is kept up to date
+# - "persisted": reuse the vectorstore on disk if it exists, otherwise build it from scratch
+# - "sync": re-fetch the docs and only upsert/delete the chunks of pages that changed
+DOCS_INDEX_MODE = os.getenv("DOCS_INDEX_MODE", "persisted")
+
+# Vectors from different backends are not comparable, so each backend gets its own store
+_docs_store_suffix = "" if EMBEDDING_BACKEND == "openai" else f"-{EMBEDDING_BACKEND}"
+DOCS_PERSIST_DIRECTORY = f"langgraph-docs-db{_docs_store_suffix}"
+DOCS_MANIFEST_PATH = f"langgraph-docs-manifest{_docs_store_suffix}.json"
+
+# NOTE: Configure the index that serves docs retrieval
+# - "chroma": query the Chroma vectorstore directly
+# - "numpy" / "numpy-int8": an in-process, memory-mapped matrix exported from the Chroma store,
+#   optionally int8-quantized to cut its size by 4x
+DOCS_VECTOR_INDEX = os.getenv("DOCS_VECTOR_INDEX", "chroma")
+
+def get_langgraph_docs_vectorstore():
+    """Load, build or sync the Chroma store."""
+    embedding_model = get_embedding_model()
     # If there is a vectorstore at this path, early return as it is already persisted
-    if os.path.exists("langgraph-docs-db"):
+    if DOCS_INDEX_MODE == "persisted" and os.path.exists(DOCS_PERSIST_DIRECTORY):
         print("Loading vectorstore from disk...")
         vectorstore = Chroma(
             collection_name="langgraph-docs",
             embedding_function=embedding_model,
-            persist_directory="langgraph-docs-db"
+            persist_directory=DOCS_PERSIST_DIRECTORY
         )
-        return vectorstore.as_retriever(lambda_mult=0)
+        return vectorstore
 
     # Otherwise, load the documents and persist to the vectorstore
-    docs = [WebBaseLoader(url).load() for url in LANGGRAPH_DOCS]
-    docs_list = [item for sublist in docs for item in sublist]
     text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
         chunk_size=200, chunk_overlap=0
     )
-    doc_splits = text_splitter.split_documents(docs_list)
     vectorstore = Chroma(
         collection_name="langgraph-docs",
         embedding_function=embedding_model,
-        persist_directory="langgraph-docs-db"
+        persist_directory=DOCS_PERSIST_DIRECTORY
+    )
+    if DOCS_INDEX_MODE == "sync":
+        # The manifest and the store must describe the same chunks, otherwise start both over
+        store_is_empty = not vectorstore.get(limit=1)["ids"]
+        if store_is_empty and os.path.exists(DOCS_MANIFEST_PATH):
+            os.remove(DOCS_MANIFEST_PATH)
+        elif not store_is_empty and not os.path.exists(DOCS_MANIFEST_PATH):
+            print("No sync manifest for the existing vectorstore, rebuilding it...")
+            vectorstore.reset_collection()
+        report = sync_documents(
+            LANGGRAPH_DOCS,
+            vectorstore,
+            text_splitter,
+            manifest_path=DOCS_MANIFEST_PATH,
+            loader=DOCS_LOADER,
+            max_workers=INGESTION_MAX_WORKERS,
+            batch_size=EMBEDDING_BATCH_SIZE,
+        )
+        print(report)
+        return vectorstore
+
+    report = ingest_documents(
+        LANGGRAPH_DOCS,
+        vectorstore,
+        text_splitter,
+        loader=DOCS_LOADER,
+        max_workers=INGESTION_MAX_WORKERS,
+        batch_size=EMBEDDING_BATCH_SIZE,
     )
-    vectorstore.add_documents(doc_splits)
+    print(report)
+    if isinstance(embedding_model, CachedEmbeddings):
+        print(f"Embedding cache: {embedding_model.hits} hits, {embedding_model.misses} misses")
+    if report.failed_urls:
+        # Persisted mode would reuse a partial store on every later start, so leave nothing behind
+        vectorstore.delete_collection()
+        shutil.rmtree(DOCS_PERSIST_DIRECTORY, ignore_errors=True)
+        SharedSystemClient.clear_system_cache()  # Chroma would otherwise keep using the deleted files
+        raise RuntimeError(f"Failed to load {len(report.failed_urls)} docs pages, nothing was persisted: {report.failed_urls}")
     print("Vectorstore created and persisted to disk")
-    return vectorstore.as_retriever(lambda_mult=0)
+    return vectorstore
 
+# NOTE: Configure how the docs are searched
+# - "dense": embedding similarity only
+# - "hybrid": embedding similarity fused with BM25 keyword search over a persisted inverted index
+DOCS_RETRIEVAL_MODE = os.getenv("DOCS_RETRIEVAL_MODE", "dense")
 
-import sqlite3
-import requests
-from sqlalchemy import create_engine
-from sqlalchemy.pool import StaticPool
+@lazy_resource
+def get_langgraph_docs_retriever(k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5):
+    """
+    Args:
+        k: Number of documents to return
+        fetch_k: Number of candidates fetched by similarity before MMR re-ranking (twice this in hybrid mode)
+        lambda_mult: MMR trade-off between relevance (1.0, plain similarity search) and diversity (0.0)
+    """
+    vectorstore = get_langgraph_docs_vectorstore()
+    embedding_model = get_embedding_model()
+    fingerprint = chroma_fingerprint(vectorstore)
+    # Hybrid search fuses the dense and BM25 rankings, so give it as many dense candidates as BM25 ones
+    # and let the fusion cut down to k
+    dense_k = fetch_k if DOCS_RETRIEVAL_MODE == "hybrid" else k
+    if DOCS_VECTOR_INDEX == "chroma":
+        fetch_candidates = chroma_candidates(vectorstore)
+        retriever = vectorstore.as_retriever(search_kwargs={"k": dense_k})
+    elif DOCS_VECTOR_INDEX in ("numpy", "numpy-int8"):
+        index_directory = f"{DOCS_PERSIST_DIRECTORY}-{DOCS_VECTOR_INDEX}"
+        # Rebuild whenever the store changed since the export, including in an earlier run or another mode
+        if read_fingerprint(index_directory) != fingerprint:
+            print(f"Exporting vectorstore to {index_directory}...")
+            export_chroma_to_numpy_index(
+                vectorstore,
+                index_directory,
+                model=get_model_name(embedding_model),
+                quantize=DOCS_VECTOR_INDEX == "numpy-int8",
+            )
+        index = NumpyVectorIndex.load(index_directory)
+        fetch_candidates = numpy_index_candidates(index)
+        retriever = NumpyIndexRetriever(index=index, embeddings=embedding_model, k=dense_k)
+    else:
+        raise ValueError(f"Unknown docs vector index: {DOCS_VECTOR_INDEX}")
+
+    if lambda_mult < 1.0:
+        # MMR must choose from more candidates than it keeps, or it only reorders them; in hybrid mode
+        # it keeps fetch_k, so it draws them from twice as many
+        retriever = MMRRetriever(
+            embeddings=embedding_model,
+            fetch_candidates=fetch_candidates,
+            k=dense_k,
+            fetch_k=max(fetch_k, 2 * dense_k),
+            lambda_mult=lambda_mult,
+        )
+
+    if DOCS_RETRIEVAL_MODE == "dense":
+        return retriever
+    if DOCS_RETRIEVAL_MODE != "hybrid":
+        raise ValueError(f"Unknown docs retrieval mode: {DOCS_RETRIEVAL_MODE}")
+    bm25_directory = f"{DOCS_PERSIST_DIRECTORY}-bm25"
+    if read_fingerprint(bm25_directory) != fingerprint:
+        print(f"Building BM25 index in {bm25_directory}...")
+        bm25_index = build_bm25_index_from_chroma(vectorstore, bm25_directory)
+    else:
+        bm25_index = BM25Index.load(bm25_directory)
+    return HybridRetriever(dense_retriever=retriever, bm25_index=bm25_index, k=k, fetch_k=fetch_k)
+
+
+from chinook import get_shared_engine
 
 def get_engine_for_chinook_db():
-    """Pull sql file, populate in-memory database, and create engine."""
-    url = "https://raw.githubusercontent.com/lerocha/chinook-database/master/ChinookDatabase/DataSources/Chinook_Sqlite.sql"
-    response = requests.get(url)
-    sql_script = response.text
-
-    connection = sqlite3.connect(":memory:", check_same_thread=False)
-    connection.executescript(sql_script)
-    return create_engine(
-        "sqlite://",
-        creator=lambda: connection,
-        poolclass=StaticPool,
-        connect_args={"check_same_thread": False},
-    )
\ No newline at end of file
+    """Return the process-wide engine for the Chinook database (see chinook.CHINOOK_DB_MODE)."""
+    return get_shared_engine()
+
+_import_timer.stop()